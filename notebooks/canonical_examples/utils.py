@@ -4,10 +4,12 @@ import xarray as xr
 import cmocean
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
+from numba import njit, vectorize
 
 g = 9.81  # Acceleration due to gravity [m/s^2]
 
 
+@njit(cache=True, fastmath=True)
 def period2wavenumber(T):
     """
     Convert wave period to wavenumber for deep water waves.
@@ -26,6 +28,25 @@ def period2wavenumber(T):
     return k
 
 
+@vectorize(["float64(float64)"], target="parallel")
+def period2wavenumber_vec(T):
+    """
+    Convert an array of wave periods to wavenumbers for deep water waves.
+
+    Parameters
+    ----------
+    T : np.ndarray
+        Wave periods in seconds.
+
+    Returns
+    -------
+    k : np.ndarray
+        Wavenumbers in radians per meter.
+    """
+    return period2wavenumber(T)
+
+
+@njit(cache=True, fastmath=True)
 def group_velocity(k):
     """
     Compute the group velocity for deep water waves given a wavenumber.
@@ -44,6 +65,7 @@ def group_velocity(k):
     return c_g
 
 
+@njit(cache=True, fastmath=True)
 def compute_cfl(x, y, k0):
     """
     Compute the optimal time step for numerical modeling based on CFL condition.
@@ -62,12 +84,16 @@ def compute_cfl(x, y, k0):
     cfl : float
         CFL-based time step in seconds.
     """
-    dd = np.min([np.diff(x).mean(), np.diff(y).mean()])
+    # mean grid spacing, i.e. the mean of np.diff
+    dx = (x[-1] - x[0]) / (x.size - 1)
+    dy = (y[-1] - y[0]) / (y.size - 1)
+    dd = min(dx, dy)
     c_g = group_velocity(k0)
     cfl = dd / c_g
     return cfl
 
 
+@njit(cache=True, fastmath=True)
 def compute_duration(x, k0):
     """
     Estimate model duration based on domain size and wave group velocity.
@@ -88,7 +114,9 @@ def compute_duration(x, k0):
     return round(x.max() / c_g)
 
 
-def animate_rays(X, Y, background, ray_bundle, style, ray_sample=1, time_sample=10):
+def animate_rays(
+    X, Y, background, ray_bundle, style, ray_sample=1, time_sample=10, save_path=None
+):
     """
     Create an animation of ray paths over a background field.
 
@@ -109,43 +137,78 @@ def animate_rays(X, Y, background, ray_bundle, style, ray_sample=1, time_sample=
         Interval for subsampling rays (default is 1).
     time_sample : int, optional
         Interval for subsampling animation time steps (default is 10).
+    save_path : str, optional
+        If given, the frames are streamed to this video file with ffmpeg as
+        they are drawn, instead of building an animation object.
 
     Returns
     -------
-    anim : matplotlib.animation.FuncAnimation
-        Animation object that can be saved or displayed.
+    anim : matplotlib.animation.FuncAnimation or None
+        Animation object that can be saved or displayed, or None if the
+        animation was saved to `save_path`.
     """
     time_steps = ray_bundle.time_step.size
 
     fig, ax = plt.subplots(figsize=(12, 6), constrained_layout=True)
 
     if style == "currents":
-        cf = ax.contourf(X, Y, background, cmap=cmocean.cm.speed, levels=50)
+        cf = ax.pcolormesh(
+            X, Y, background, cmap=cmocean.cm.speed, shading="auto", rasterized=True
+        )
         cbar = fig.colorbar(cf)
         cbar.set_label("Speed [m/s]")
     if style == "bathymetry":
-        cf = ax.contourf(X, Y, background, cmap=cmocean.cm.deep, levels=50)
+        cf = ax.pcolormesh(
+            X, Y, background, cmap=cmocean.cm.deep, shading="auto", rasterized=True
+        )
+        ax.contour(X, Y, background, levels=10, colors="k", linewidths=0.3)
         cbar = fig.colorbar(cf)
         cbar.set_label("Depth [m]")
 
+    # extract the sampled rays once as single precision (ray, time_step)
+    # arrays, so that each frame only slices views of them
+    xs = ray_bundle.x.transpose("ray", "time_step").values[::ray_sample]
+    ys = ray_bundle.y.transpose("ray", "time_step").values[::ray_sample]
+    xs = xs.astype(np.float32, copy=False)
+    ys = ys.astype(np.float32, copy=False)
+
+    color = "black" if style == "currents" else "white"
     ray_lines = []
-    for i in range(0, ray_bundle.ray.size, ray_sample):
-        color = "black" if style == "currents" else "white"
+    for _ in range(xs.shape[0]):
         (ray,) = ax.plot([], [], lw=0.78, color=color)
         ray_lines.append(ray)
 
     ax.set_xlabel("X [m]")
     ax.set_ylabel("Y [m]")
     ax.set_title("Ray Tracing Animation")
+    # the time step is shown inside the axes since blitting only redraws the
+    # axes area
+    time_text = ax.text(0.01, 0.98, "", transform=ax.transAxes, va="top", color=color)
 
     def animate(frame):
         for i, ray_line in enumerate(ray_lines):
-            ray = ray_bundle.isel(ray=i * ray_sample).sel(time_step=slice(0, frame))
-            ray_line.set_data(ray.x, ray.y)
-        ax.set_title(f"Ray Tracing Animation - Time Step {frame}")
+            ray_line.set_data(xs[i, : frame + 1], ys[i, : frame + 1])
+        time_text.set_text(f"Time Step {frame}")
+        return (*ray_lines, time_text)
+
+    frames = range(0, time_steps, time_sample)
+
+    if save_path is not None:
+        # same frame rate as the 100 ms interval of the interactive animation
+        writer = animation.FFMpegWriter(fps=10)
+        with writer.saving(fig, save_path, dpi=100):
+            for frame in frames:
+                animate(frame)
+                writer.grab_frame()
+        plt.close(fig)
+        return None
 
     anim = animation.FuncAnimation(
-        fig, animate, frames=range(0, time_steps, time_sample), interval=100
+        fig,
+        animate,
+        frames=frames,
+        interval=100,
+        blit=True,
     )
 
     plt.close(fig)
@@ -186,7 +249,7 @@ def plot_current_field(x_grid, y_grid, ds, skip=75, q_ref=0.5, q_scale=0.1):
     - Quiver vectors are plotted in black and scaled by `q_scale`.
     - Axes are labeled in kilometers, and the plot enforces equal aspect ratio.
     """
-    speed = np.sqrt(ds.u**2 + ds.v**2)
+    speed = np.hypot(ds.u, ds.v)
 
     fig, ax = plt.subplots(figsize=(12, 6))
 
@@ -1,3 +1,3 @@
-from .core import single_ray, ray_tracing
+from .core import RayEnvironment, clear_cache, ray_tracing, single_ray
 
-__all__ = ["single_ray", "ray_tracing"]
+__all__ = ["RayEnvironment", "clear_cache", "ray_tracing", "single_ray"]
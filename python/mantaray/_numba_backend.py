@@ -0,0 +1,446 @@
+"""Numba implementation of the ray tracing
+
+Fallback used by :mod:`mantaray.core` when the compiled Rust extension,
+``mantaray._mantaray``, is not available. It exposes the same
+``RayEnvironment`` interface and integrates the same system of equations,
+with a fixed step Runge-Kutta 4 (rays in parallel with ``prange``) or an
+adaptive Runge-Kutta-Cash-Karp 5(4).
+
+The bathymetry and current are bilinearly interpolated on their grids, which
+must be equally spaced in ascending order. As in the Rust implementation, the
+variables are read in the order they are stored in the file, with x varying
+fastest, and a ray stops once it leaves either grid.
+"""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numba
+import numpy as np
+import xarray as xr
+from numba import njit, prange
+
+# acceleration of gravity [m/s^2]
+G = 9.8
+
+# default tolerances of the adaptive time step, same as the Rust
+# implementation
+DEFAULT_RTOL = 1e-6
+DEFAULT_ATOL = 1e-9
+
+# time steps in the first block of the fixed step output, the following
+# blocks double in size, so the output follows how long the rays last
+# instead of the requested duration
+INITIAL_RECORDS = 1024
+
+# fastmath without the no-NaN/no-Inf assumptions, since a NaN state is how a
+# ray leaving the domain is detected
+_FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+# Butcher tableau of the Runge-Kutta-Cash-Karp 5(4) method, row i of A is
+# used by stage i + 1, B the 5th order solution and E the difference to the
+# embedded 4th order solution, as in the Rust implementation
+_CK_A = np.array(
+    [
+        [0.0, 0.0, 0.0, 0.0, 0.0],
+        [1.0 / 5.0, 0.0, 0.0, 0.0, 0.0],
+        [3.0 / 40.0, 9.0 / 40.0, 0.0, 0.0, 0.0],
+        [3.0 / 10.0, -9.0 / 10.0, 6.0 / 5.0, 0.0, 0.0],
+        [-11.0 / 54.0, 5.0 / 2.0, -70.0 / 27.0, 35.0 / 27.0, 0.0],
+        [
+            1631.0 / 55296.0,
+            175.0 / 512.0,
+            575.0 / 13824.0,
+            44275.0 / 110592.0,
+            253.0 / 4096.0,
+        ],
+    ]
+)
+_CK_B = np.array([37.0 / 378.0, 0.0, 250.0 / 621.0, 125.0 / 594.0, 0.0, 512.0 / 1771.0])
+_CK_E = _CK_B - np.array(
+    [
+        2825.0 / 27648.0,
+        0.0,
+        18575.0 / 48384.0,
+        13525.0 / 55296.0,
+        277.0 / 14336.0,
+        0.25,
+    ]
+)
+
+
+def _read_grid(filename, names):
+    """Read the x and y grid and the `names` fields from a NetCDF file
+
+    Returns the fields as (y, x) arrays and the grid as (x0, dx, y0, dy).
+    """
+    with xr.open_dataset(filename, mask_and_scale=False) as ds:
+        x = ds["x"].values.astype(np.float64)
+        y = ds["y"].values.astype(np.float64)
+        fields = [
+            np.ascontiguousarray(ds[n].values, dtype=np.float64).reshape(y.size, x.size)
+            for n in names
+        ]
+    dx = x[1] - x[0] if x.size > 1 else 1.0
+    dy = y[1] - y[0] if y.size > 1 else 1.0
+    return fields, (x[0], dx, y[0], dy)
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _bilinear(field, grid, x, y):
+    """Value and gradient of `field` at (x, y), NaN outside of the grid"""
+    x0, dx, y0, dy = grid
+    ny, nx = field.shape
+    fi = (x - x0) / dx
+    fj = (y - y0) / dy
+    # written so that a NaN position is also out of the grid
+    if not (fi >= 0.0 and fi <= nx - 1 and fj >= 0.0 and fj <= ny - 1):
+        return np.nan, np.nan, np.nan
+    if nx < 2 or ny < 2:
+        return np.nan, np.nan, np.nan
+
+    # clamp the lower corner, points on the last row or column use the last
+    # cell with a fraction of one
+    i = min(int(fi), nx - 2)
+    j = min(int(fj), ny - 2)
+    fx = fi - i
+    fy = fj - j
+
+    sw = field[j, i]
+    se = field[j, i + 1]
+    nw = field[j + 1, i]
+    ne = field[j + 1, i + 1]
+    south = sw + fx * (se - sw)
+    north = nw + fx * (ne - nw)
+    return south + fy * (north - south), (se - sw) / dx, (nw - sw) / dy
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _odes(x, y, kx, ky, depth, depth_grid, u, v, current_grid):
+    """Derivatives (dx/dt, dy/dt, dkx/dt, dky/dt) at the state (x, y, kx, ky)
+
+    All NaN if the ray is out of the domain, in dry land, or has no
+    wavenumber.
+    """
+    h, dhdx, dhdy = _bilinear(depth, depth_grid, x, y)
+    uc, dudx, dudy = _bilinear(u, current_grid, x, y)
+    vc, dvdx, dvdy = _bilinear(v, current_grid, x, y)
+
+    k = math.sqrt(kx * kx + ky * ky)
+    if not (k > 0.0 and h > 0.0):
+        return np.nan, np.nan, np.nan, np.nan
+
+    kh = k * h
+    theta = math.atan2(ky, kx)
+    cg = (G / 2.0) * (
+        (math.tanh(kh) + kh / math.cosh(kh) ** 2) / math.sqrt(k * G * math.tanh(kh))
+    )
+    # -k / (2 sinh(kh) cosh(kh)) * sqrt(g k tanh(kh)), times the depth gradient
+    refraction = (
+        -0.5 * k / (math.sinh(kh) * math.cosh(kh)) * math.sqrt(G * k * math.tanh(kh))
+    )
+
+    return (
+        cg * math.cos(theta) + uc,
+        cg * math.sin(theta) + vc,
+        refraction * dhdx - kx * dudx - ky * dvdx,
+        refraction * dhdy - kx * dudy - ky * dvdy,
+    )
+
+
+@njit(parallel=True, cache=True, fastmath=_FASTMATH)
+def _rk4_batch(s, first_step, dt, depth, depth_grid, u, v, current_grid, out):
+    """Integrate each ray with a fixed step Runge-Kutta 4
+
+    The rays are independent, thus integrated in parallel. Advances the
+    (ray, 4) state `s` in place, starting from the step `first_step`, by as
+    many steps as `out` holds. `out` has shape (5, ray, time_step), is
+    filled with NaN, and receives (t, x, y, kx, ky) until each ray reaches a
+    NaN state, which is then kept in `s`. Returns the number of records of
+    each ray.
+
+    The state and the stages are kept as scalars, so that nothing is
+    allocated inside of the time loop.
+    """
+    n_rays = s.shape[0]
+    n_records = np.zeros(n_rays, dtype=np.int64)
+    for r in prange(n_rays):
+        x, y, kx, ky = s[r, 0], s[r, 1], s[r, 2], s[r, 3]
+        if math.isnan(x) or math.isnan(y) or math.isnan(kx) or math.isnan(ky):
+            continue
+
+        n = 0
+        half = 0.5 * dt
+        while n < out.shape[2]:
+            a1, b1, c1, d1 = _odes(x, y, kx, ky, depth, depth_grid, u, v, current_grid)
+            a2, b2, c2, d2 = _odes(
+                x + half * a1,
+                y + half * b1,
+                kx + half * c1,
+                ky + half * d1,
+                depth,
+                depth_grid,
+                u,
+                v,
+                current_grid,
+            )
+            a3, b3, c3, d3 = _odes(
+                x + half * a2,
+                y + half * b2,
+                kx + half * c2,
+                ky + half * d2,
+                depth,
+                depth_grid,
+                u,
+                v,
+                current_grid,
+            )
+            a4, b4, c4, d4 = _odes(
+                x + dt * a3,
+                y + dt * b3,
+                kx + dt * c3,
+                ky + dt * d3,
+                depth,
+                depth_grid,
+                u,
+                v,
+                current_grid,
+            )
+            x += dt / 6.0 * (a1 + 2.0 * (a2 + a3) + a4)
+            y += dt / 6.0 * (b1 + 2.0 * (b2 + b3) + b4)
+            kx += dt / 6.0 * (c1 + 2.0 * (c2 + c3) + c4)
+            ky += dt / 6.0 * (d1 + 2.0 * (d2 + d3) + d4)
+            if math.isnan(x) or math.isnan(y) or math.isnan(kx) or math.isnan(ky):
+                break
+            out[0, r, n] = (first_step + n) * dt
+            out[1, r, n] = x
+            out[2, r, n] = y
+            out[3, r, n] = kx
+            out[4, r, n] = ky
+            n += 1
+        n_records[r] = n
+        s[r, 0], s[r, 1], s[r, 2], s[r, 3] = x, y, kx, ky
+    return n_records
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _cash_karp_step(s, h, depth, depth_grid, u, v, current_grid, k):
+    """One Runge-Kutta-Cash-Karp 5(4) step, returns the solution and error
+
+    `k` is a (6, 4) work array for the stages, reused between steps.
+    """
+    for stage in range(6):
+        x, y, kx, ky = s[0], s[1], s[2], s[3]
+        for j in range(stage):
+            a = h * _CK_A[stage, j]
+            x += a * k[j, 0]
+            y += a * k[j, 1]
+            kx += a * k[j, 2]
+            ky += a * k[j, 3]
+        k[stage, 0], k[stage, 1], k[stage, 2], k[stage, 3] = _odes(
+            x, y, kx, ky, depth, depth_grid, u, v, current_grid
+        )
+
+    s_new = s.copy()
+    err = np.zeros(4)
+    for j in range(6):
+        for i in range(4):
+            s_new[i] += h * _CK_B[j] * k[j, i]
+            err[i] += h * _CK_E[j] * k[j, i]
+    return s_new, err
+
+
+@njit(cache=True, nogil=True, fastmath=_FASTMATH)
+def _adaptive_path(
+    s0, end_time, step_size, rtol, atol, depth, depth_grid, u, v, current_grid
+):
+    """Integrate one ray with an adaptive time step
+
+    Returns the (t, x, y, kx, ky) of every accepted step as a (5, n) array.
+    A step that results in a NaN state is rejected and retried shorter, the
+    integration stops once such a step is already at the minimum step size.
+    """
+    path = np.empty(
+        (5, min(max(int(math.ceil(end_time / step_size)) + 1, 2), INITIAL_RECORDS))
+    )
+    if np.isnan(s0).any():
+        return path[:, :0]
+
+    min_step = 1e-6 * step_size
+    t = 0.0
+    s = s0.copy()
+    h = step_size
+    k = np.empty((6, 4))
+    path[0, 0] = t
+    path[1:, 0] = s
+    n = 1
+
+    while t < end_time:
+        # don't overshoot, and land exactly on, the end time
+        last_step = h >= end_time - t
+        h_try = end_time - t if last_step else h
+        s_new, err = _cash_karp_step(s, h_try, depth, depth_grid, u, v, current_grid, k)
+        if np.isnan(s_new).any():
+            # the trial step left the domain, retry shorter to get closer to
+            # the boundary, until the step can't be any shorter
+            if h_try <= min_step:
+                break
+            h = max(h_try * 0.1, min_step)
+            continue
+
+        err_norm = 0.0
+        for i in range(4):
+            scale = atol + rtol * max(abs(s[i]), abs(s_new[i]))
+            err_norm = max(err_norm, abs(err[i]) / scale)
+
+        if err_norm <= 1.0 or h_try <= min_step:
+            t = end_time if last_step else t + h_try
+            s = s_new
+            if n == path.shape[1]:
+                grown = np.empty((5, 2 * n))
+                grown[:, :n] = path
+                path = grown
+            path[0, n] = t
+            path[1:, n] = s
+            n += 1
+            if err_norm == 0.0:
+                h = h_try * 5.0
+            else:
+                h = h_try * min(0.9 * err_norm**-0.2, 5.0)
+        else:
+            h = h_try * max(0.9 * err_norm**-0.25, 0.1)
+        h = max(h, min_step)
+    return path[:, :n]
+
+
+class RayEnvironment:
+    """Bathymetry and current loaded once and shared by many ray tracings
+
+    Same interface as the ``RayEnvironment`` of the compiled extension.
+    """
+
+    def __init__(self, bathymetry_filename, current_filename):
+        (self._depth,), self._depth_grid = _read_grid(bathymetry_filename, ["depth"])
+        (self._u, self._v), self._current_grid = _read_grid(
+            current_filename, ["u", "v"]
+        )
+
+    def _fields(self):
+        return self._depth, self._depth_grid, self._u, self._v, self._current_grid
+
+    def single_ray(
+        self,
+        x0,
+        y0,
+        kx0,
+        ky0,
+        duration,
+        step_size,
+        rtol=None,
+        atol=None,
+        float32=False,
+    ):
+        """Trace a single ray, as a (5, time_step) array of (t, x, y, kx, ky)"""
+        out = self.ray_tracing(
+            np.array([x0], dtype=np.float64),
+            np.array([y0], dtype=np.float64),
+            np.array([kx0], dtype=np.float64),
+            np.array([ky0], dtype=np.float64),
+            duration,
+            step_size,
+            rtol=rtol,
+            atol=atol,
+            n_threads=1,
+            float32=float32,
+        )
+        return np.stack([v[0] for v in out])
+
+    def ray_tracing(
+        self,
+        x0,
+        y0,
+        kx0,
+        ky0,
+        duration,
+        step_size,
+        rtol=None,
+        atol=None,
+        n_threads=None,
+        float32=False,
+    ):
+        """Trace a batch of rays
+
+        Returns a tuple of (t, x, y, kx, ky) arrays, each with shape
+        (ray, time_step), padded with NaN.
+        """
+        if not (len(x0) == len(y0) == len(kx0) == len(ky0)):
+            raise ValueError("initial conditions must have the same length")
+        if not (step_size > 0 and math.isfinite(step_size)):
+            raise ValueError("step_size must be positive and finite")
+        s0 = np.stack([x0, y0, kx0, ky0], axis=-1).astype(np.float64)
+
+        # same as rayon, 0 means the default number of threads, and there is
+        # no point in more threads than numba can run
+        if n_threads is not None:
+            n_threads = min(n_threads, numba.config.NUMBA_NUM_THREADS) or None
+
+        if rtol is None and atol is None:
+            out = self._trace(s0, duration, step_size, n_threads)
+        else:
+            out = self._trace_adaptive(
+                s0,
+                duration,
+                step_size,
+                DEFAULT_RTOL if rtol is None else rtol,
+                DEFAULT_ATOL if atol is None else atol,
+                n_threads,
+            )
+
+        if float32:
+            out = out.astype(np.float32)
+        return tuple(out)
+
+    def _trace(self, s0, duration, step_size, n_threads):
+        n_steps = int(math.ceil(duration / step_size))
+        if s0.shape[0] == 0:
+            return np.empty((5, 0, 0))
+
+        # the initial state, all NaN for the rays that don't start
+        s = s0.copy()
+        s[np.isnan(s).any(axis=1)] = np.nan
+        start = np.full((5, s.shape[0], 1), np.nan)
+        start[0, ~np.isnan(s[:, 0]), 0] = 0.0
+        start[1:, :, 0] = s.T
+        blocks = [start]
+
+        previous = numba.get_num_threads()
+        if n_threads is not None:
+            numba.set_num_threads(n_threads)
+        try:
+            done = 0
+            size = INITIAL_RECORDS
+            while done < n_steps and not np.isnan(s[:, 0]).all():
+                out = np.full((5, s.shape[0], min(size, n_steps - done)), np.nan)
+                n_records = _rk4_batch(s, done + 1, step_size, *self._fields(), out)
+                blocks.append(out[:, :, : n_records.max(initial=0)])
+                done += out.shape[2]
+                size *= 2
+        finally:
+            numba.set_num_threads(previous)
+
+        return np.concatenate(blocks, axis=2)
+
+    def _trace_adaptive(self, s0, duration, step_size, rtol, atol, n_threads):
+        def path(s):
+            return _adaptive_path(s, duration, step_size, rtol, atol, *self._fields())
+
+        # the adaptive integration releases the GIL, so the rays can run
+        # on threads
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            paths = list(executor.map(path, s0))
+
+        n_records = max((p.shape[1] for p in paths), default=0)
+        out = np.full((5, s0.shape[0], n_records), np.nan)
+        for r, p in enumerate(paths):
+            out[:, r, : p.shape[1]] = p
+        return out
@@ -1,9 +1,23 @@
 import datetime
+import os
+from typing import Optional
 
 import numpy as np
 import xarray as xr
 
-from . import _mantaray
+try:
+    from . import _mantaray
+except ImportError:
+    # compiled extension not available, use the (slower) numba implementation
+    from . import _numba_backend as _mantaray
+
+# timestamp of the outputs, computed once instead of at every call
+_IMPORT_TIME = datetime.datetime.now().isoformat(timespec="seconds")
+
+# dimensions of the output variables, for a single ray and for many rays
+_SINGLE_RAY_DIMS = ("time_step",)
+_RAY_TRACING_DIMS = ("ray", "time_step")
+_VARNAMES = ("time", "x", "y", "kx", "ky")
 
 
 def single_ray(
@@ -15,6 +29,11 @@ def single_ray(
     step_size: float,
     bathymetry: str,
     current: str,
+    *,
+    rtol: Optional[float] = None,
+    atol: Optional[float] = None,
+    output_dtype: np.dtype = np.float64,
+    attrs: Optional[dict] = None,
 ) -> xr.Dataset:
     """Propagate a single ray without considering the effect of currents
 
@@ -31,7 +50,8 @@ def single_ray(
     duration : float
         Duration of the simulation
     step_size : float
-        Time step for the simulation
+        Time step for the simulation. If using an adaptive time step, this
+        is only the initial time step.
     bathymetry : str
         Path to a netCDF file containing the bathymetry file. It is expected
         to have x and y dimensions as floats and depth (x, y) as a float,
@@ -39,6 +59,21 @@ def single_ray(
     current : str
         Paths to a netCDF file containing the current field. It is expected
         to have x and y dimensions as floats and u(x,y) and v(x,y) as floats.
+    rtol : float, optional
+        Relative tolerance for an adaptive time step. If either `rtol` or
+        `atol` is given, the ray is integrated with an embedded
+        Runge-Kutta-Cash-Karp scheme with an adaptive time step, thus the
+        output time is not uniform. Otherwise, a fixed time step is used.
+    atol : float, optional
+        Absolute tolerance for an adaptive time step.
+    output_dtype : np.dtype, default np.float64
+        Data type of the output, either float64 or float32. The integration
+        is always done in double precision, but single precision halves the
+        memory of long trajectories, e.g. for plotting or animation.
+    attrs : dict, optional
+        Attributes of the output dataset. By default, `date_created` (when
+        mantaray was imported) and `created_by`. Pass an empty dict to skip
+        them, e.g. in a sweep over many small ray tracings.
 
     Return
     ------
@@ -49,21 +84,20 @@ def single_ray(
     --------
     >>> mantaray.single_ray(-1000, 0, 0.01, 0, 10, 2, "island.nc")
     """
-    tmp = _mantaray.single_ray(
-        x0, y0, kx0, ky0, duration, step_size, str(bathymetry), str(current)
+    env = RayEnvironment(bathymetry, current)
+    return env.single_ray(
+        x0,
+        y0,
+        kx0,
+        ky0,
+        duration,
+        step_size,
+        rtol=rtol,
+        atol=atol,
+        output_dtype=output_dtype,
+        attrs=attrs,
     )
 
-    tmp = np.array(tmp)
-    varnames = ["time", "x", "y", "kx", "ky"]
-    output = xr.Dataset(
-        data_vars={v: (["time_step"], t) for (v, t) in zip(varnames, tmp.T)},
-        attrs={
-            "date_created": str(datetime.datetime.now()),
-        },
-    ).set_coords(["time", "x", "y"])
-
-    return output
-
 
 def ray_tracing(
     x0,
@@ -74,11 +108,19 @@ def ray_tracing(
     step_size: float,
     bathymetry: str,
     current: str,
+    *,
+    rtol: Optional[float] = None,
+    atol: Optional[float] = None,
+    n_threads: Optional[int] = None,
+    output_dtype: np.dtype = np.float64,
+    attrs: Optional[dict] = None,
 ) -> xr.Dataset:
     """Ray tracing for multiple initial conditions
 
     For a given set of initial conditions, progapage those multiple rays in
-    parallel and return the projections for each ray
+    lockstep, i.e. all rays advance with the same time step, and return the
+    projections for each ray. Rays that stop before the others, such as when
+    leaving the domain, are padded with NaN.
 
     Parameters
     ----------
@@ -93,7 +135,8 @@ def ray_tracing(
     duration : float
         Duration of the simulation
     step_size : float
-        Time step for the simulation
+        Time step for the simulation. If using an adaptive time step, this
+        is only the initial time step.
     bathymetry : str
         Path to a netCDF file containing the bathymetry file. It is expected
         x and y dimensions as floats and depth (x, y) as a float, where
@@ -101,32 +144,209 @@ def ray_tracing(
     current : str
         Paths to a netCDF file containing the current field. It is expected
         to have x and y dimensions as floats and u(x,y) and v(x,y) as floats.
+    rtol : float, optional
+        Relative tolerance for an adaptive time step. If either `rtol` or
+        `atol` is given, each ray is integrated with an embedded
+        Runge-Kutta-Cash-Karp scheme with its own adaptive time step, thus
+        the output time is not uniform and differs between rays. Otherwise,
+        all rays advance in lockstep with a fixed time step.
+    atol : float, optional
+        Absolute tolerance for an adaptive time step.
+    n_threads : int, optional
+        Number of threads used to trace the rays in parallel. By default,
+        one thread per core.
+    output_dtype : np.dtype, default np.float64
+        Data type of the output, either float64 or float32. The integration
+        is always done in double precision, but single precision halves the
+        memory of long trajectories, e.g. for plotting or animation.
+    attrs : dict, optional
+        Attributes of the output dataset. By default, `date_created` (when
+        mantaray was imported) and `created_by`. Pass an empty dict to skip
+        them, e.g. in a sweep over many small ray tracings.
 
     Returns
     -------
     xr.Dataset :
         A dataset containing the time evolution of multiple rays.
     """
-    tmp = _mantaray.ray_tracing(
-        x0, y0, kx0, ky0, duration, step_size, bathymetry, current
+    env = RayEnvironment(bathymetry, current)
+    return env.ray_tracing(
+        x0,
+        y0,
+        kx0,
+        ky0,
+        duration,
+        step_size,
+        rtol=rtol,
+        atol=atol,
+        n_threads=n_threads,
+        output_dtype=output_dtype,
+        attrs=attrs,
     )
 
-    varnames = ["time", "x", "y", "kx", "ky"]
-    longest_ray = max([len(ray) for ray in tmp])
-    bundle = [
-        np.pad(ray, ((0, longest_ray - len(ray)), (0, 0)), constant_values=np.nan)
-        for ray in tmp
-    ]
+
+def _is_float32(output_dtype) -> bool:
+    """Validate the output dtype, True if single precision"""
+    output_dtype = np.dtype(output_dtype)
+    if output_dtype not in (np.float32, np.float64):
+        raise ValueError(f"output_dtype must be float32 or float64, got {output_dtype}")
+    return output_dtype == np.float32
+
+
+def _wrap_output(tmp, dims, attrs: Optional[dict] = None) -> xr.Dataset:
+    """Dataset from the (time, x, y, kx, ky) arrays returned by Rust"""
+    if attrs is None:
+        attrs = {"date_created": _IMPORT_TIME, "created_by": "mantaray"}
+    # the arrays already have the output dimensions, build the variables
+    # directly instead of letting xarray infer them from (dims, data) tuples
     ds = xr.Dataset(
-        data_vars={
-            name: (["time_step", "ray"], v)
-            for (name, v) in zip(varnames, np.array(bundle).T)
-        }
+        data_vars={v: xr.Variable(dims, t) for (v, t) in zip(_VARNAMES, tmp)},
+        attrs=attrs,
     )
+    return ds.set_coords(["time", "x", "y"])
+
+
+# loaded environments, by absolute (bathymetry, current) path, with the
+# modification times they were loaded with. Kept small since each entry holds
+# both fields in memory.
+_ENVIRONMENT_CACHE = {}
+_ENVIRONMENT_CACHE_SIZE = 2
+
+
+def _load_environment(bathymetry: str, current: str):
+    """Load the fields, cached by file path and modification time
+
+    A file that was modified since it was loaded replaces its cached entry,
+    and the oldest entry is dropped once the cache is full.
+    """
+    key = (os.path.abspath(bathymetry), os.path.abspath(current))
+    mtimes = (os.stat(key[0]).st_mtime_ns, os.stat(key[1]).st_mtime_ns)
+
+    cached = _ENVIRONMENT_CACHE.pop(key, None)
+    if cached is not None and cached[0] == mtimes:
+        env = cached[1]
+    else:
+        # release a stale copy before loading the new one
+        cached = None
+        env = _mantaray.RayEnvironment(*key)
+    _ENVIRONMENT_CACHE[key] = (mtimes, env)
+
+    while len(_ENVIRONMENT_CACHE) > _ENVIRONMENT_CACHE_SIZE:
+        del _ENVIRONMENT_CACHE[next(iter(_ENVIRONMENT_CACHE))]
+    return env
+
+
+def clear_cache() -> None:
+    """Release the bathymetry and current kept by the environment cache
+
+    :class:`RayEnvironment`, and thus :func:`single_ray` and
+    :func:`ray_tracing`, keep the last loaded fields to reuse them when
+    tracing again on the same files. Environments still referenced elsewhere
+    are not affected.
+    """
+    _ENVIRONMENT_CACHE.clear()
+
+
+class RayEnvironment:
+    """Bathymetry and current shared by many ray tracings
+
+    The bathymetry and current files are read once and reused by every ray
+    traced in this environment. The last loaded environments are also cached
+    by file path and modification time, so re-creating one for files that
+    didn't change, such as when re-running a notebook, doesn't read them
+    again. Use :func:`clear_cache` to release them.
+
+    Parameters
+    ----------
+    bathymetry : str
+        Path to a netCDF file containing the bathymetry file. It is expected
+        to have x and y dimensions as floats and depth (x, y) as a float,
+        where depth is zero at surface and positive downwards.
+    current : str
+        Paths to a netCDF file containing the current field. It is expected
+        to have x and y dimensions as floats and u(x,y) and v(x,y) as floats.
+
+    Examples
+    --------
+    >>> env = mantaray.RayEnvironment("island.nc", "current.nc")
+    >>> for kx0 in [0.01, 0.02, 0.03]:
+    ...     ds = env.single_ray(-1000, 0, kx0, 0, 10, 2)
+    """
+
+    def __init__(self, bathymetry: str, current: str):
+        self.bathymetry = str(bathymetry)
+        self.current = str(current)
+        self._env = _load_environment(self.bathymetry, self.current)
+
+    def single_ray(
+        self,
+        x0: float,
+        y0: float,
+        kx0: float,
+        ky0: float,
+        duration: float,
+        step_size: float,
+        *,
+        rtol: Optional[float] = None,
+        atol: Optional[float] = None,
+        output_dtype: np.dtype = np.float64,
+        attrs: Optional[dict] = None,
+    ) -> xr.Dataset:
+        """Propagate a single ray in this environment
+
+        See :func:`single_ray` for the description of the arguments.
+        """
+        tmp = self._env.single_ray(
+            x0,
+            y0,
+            kx0,
+            ky0,
+            duration,
+            step_size,
+            rtol=rtol,
+            atol=atol,
+            float32=_is_float32(output_dtype),
+        )
+
+        return _wrap_output(tmp, _SINGLE_RAY_DIMS, attrs)
+
+    def ray_tracing(
+        self,
+        x0,
+        y0,
+        kx0,
+        ky0,
+        duration: float,
+        step_size: float,
+        *,
+        rtol: Optional[float] = None,
+        atol: Optional[float] = None,
+        n_threads: Optional[int] = None,
+        output_dtype: np.dtype = np.float64,
+        attrs: Optional[dict] = None,
+    ) -> xr.Dataset:
+        """Ray tracing for multiple initial conditions in this environment
+
+        See :func:`ray_tracing` for the description of the arguments.
+        """
+        x0, y0, kx0, ky0 = (
+            np.ascontiguousarray(v, dtype=np.float64) for v in (x0, y0, kx0, ky0)
+        )
+        tmp = self._env.ray_tracing(
+            x0,
+            y0,
+            kx0,
+            ky0,
+            duration,
+            step_size,
+            rtol=rtol,
+            atol=atol,
+            n_threads=n_threads,
+            float32=_is_float32(output_dtype),
+        )
 
-    ds = ds.set_coords(["time", "x", "y"])
-    ds["time_step"] = range(ds.sizes["time_step"])
-    ds["ray"] = np.arange(len(ds.ray))
-    ds.attrs["date_created"] = str(datetime.datetime.now())
+        ds = _wrap_output(tmp, _RAY_TRACING_DIMS, attrs)
+        ds["time_step"] = range(ds.sizes["time_step"])
+        ds["ray"] = np.arange(len(ds.ray))
 
-    return ds
+        return ds
@@ -8,6 +8,7 @@ import matplotlib.figure
 import matplotlib.pyplot as plt
 import numpy as np
 import xarray as xr
+from matplotlib.collections import LineCollection
 
 
 def plot_ray_tracing(
@@ -15,6 +16,7 @@ def plot_ray_tracing(
     *,
     bathymetry: Optional[xr.Dataset] = None,
     current: Optional[xr.Dataset] = None,
+    current_spacing: int = 1,
 ) -> tuple[matplotlib.figure.Figure, matplotlib.axes.Axes]:
     """Plot the ray bundle using matplotlib. Optionally plot bathymetry or current.
 
@@ -30,6 +32,10 @@ def plot_ray_tracing(
     current : xarray.Dataset, optional
         The path of the current file to plot
 
+    current_spacing : int, default 1
+        Plot a current vector every `current_spacing` grid points in each
+        direction
+
     Returns
     -------
     tuple[matplotlib.figure.Figure, matplotlib.axes.Axes]
@@ -41,12 +47,12 @@ def plot_ray_tracing(
         fig, axs = plt.subplots(1, 2, figsize=(10, 4))
         ax1, ax2 = axs
 
-        plot_current(current, ax1)
+        plot_current(current, ax1, current_spacing)
         plot_bathymetry_heatmap(bathymetry, ax2)
     else:
         fig, ax = plt.subplots()
         if current:
-            plot_current(current, ax)
+            plot_current(current, ax, current_spacing)
         if bathymetry:
             plot_bathymetry_heatmap(bathymetry, ax)
 
@@ -60,32 +66,37 @@ def plot_ray_tracing(
 
 
 def plot_ray_bundle(ray_bundle, ax):
-    for _, ray in ray_bundle.groupby("ray"):
-        x = ray.x.values.flatten()
-        y = ray.y.values.flatten()
-        ax.plot(x, y, color="r")
+    # all rays are drawn as a single collection of (ray, time_step, 2) lines,
+    # single precision is enough for plotting (no copy if already float32)
+    x = np.atleast_2d(ray_bundle.x.transpose(..., "time_step").values)
+    y = np.atleast_2d(ray_bundle.y.transpose(..., "time_step").values)
+    segments = np.stack([x, y], axis=-1).astype(np.float32, copy=False)
+    ax.add_collection(LineCollection(segments, colors="r"))
+    ax.autoscale_view()
 
 
 def plot_bathymetry_heatmap(bathymetry, ax):
     bathymetry.depth.plot(ax=ax, cbar_kwargs={"orientation": "horizontal"})
 
 
-def plot_current(current, ax):
+def plot_current(current, ax, spacing: int = 1):
     x = current.x.values
     y = current.y.values
     u = current.u.values
     v = current.v.values
 
-    speed = np.sqrt(u**2 + v**2)
+    speed = np.hypot(u, v)
     im = ax.imshow(speed, extent=(x[0], x[-1], y[0], y[-1]))
     colorbar = ax.figure.colorbar(im, ax=ax, orientation="horizontal")
     colorbar.ax.set_xlabel("Current Speed [m/s]")
-    X, Y = np.meshgrid(x, y)
+
+    # sub-sample before the meshgrid, so that only the arrows are allocated
+    X, Y = np.meshgrid(x[::spacing], y[::spacing])
 
     ax.quiver(
         X,
         Y,
-        u,
-        v,
+        u[::spacing, ::spacing],
+        v[::spacing, ::spacing],
         scale=10,
     )
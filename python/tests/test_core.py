@@ -1,10 +1,16 @@
 """Demo for testing the core module. We shall improve this."""
 
-import mantaray
+import importlib
+import os
+import sys
 
 import numpy as np
+import pytest
 import xarray as xr
 
+import mantaray
+from mantaray import core
+
 
 def deep_water_constant_depth():
     ds = xr.Dataset(
@@ -53,6 +59,31 @@ def test_single_ray(tmp_path):
     assert (ds.ky == 0.0).all()
 
 
+def test_single_ray_adaptive(tmp_path):
+    """Adaptive time step reaches the end with fewer, non-uniform, steps"""
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    ds = mantaray.single_ray(
+        -1000,
+        0,
+        0.01,
+        0,
+        100,
+        1,
+        tmp_path / "island.nc",
+        tmp_path / "current.nc",
+        rtol=1e-6,
+    )
+
+    assert ds.sizes["time_step"] < 101
+    assert ds.time[-1] == 100
+    assert (ds.kx == 0.01).all()
+
+
 def test_multiple_rays(tmp_path):
     """Test multiple rays."""
     ds = deep_water_constant_depth()
@@ -99,3 +130,240 @@ def test_rays_variable_length(tmp_path):
         str(tmp_path / "island.nc"),
         str(tmp_path / "current.nc"),
     )
+
+    # the ray going left reaches the boundary first and is padded with NaN
+    assert ds.x.isel(ray=0).isnull().any()
+    assert ds.x.isel(ray=1, time_step=-1).notnull()
+
+
+def test_long_duration(tmp_path):
+    """The output grows with the rays, not with the requested duration"""
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    env = mantaray.RayEnvironment(tmp_path / "island.nc", tmp_path / "current.nc")
+
+    # every ray leaves the domain within about 600 steps
+    ds = env.ray_tracing(100 * [-1e3], 100 * [0], 100 * [-0.01], 100 * [0], 1e7, 1)
+    assert ds.sizes["time_step"] < 1000
+
+    ds = env.ray_tracing(2 * [-1e3], 2 * [0], 2 * [-0.01], 2 * [0], 1e7, 1, rtol=1e-6)
+    assert ds.sizes["time_step"] < 1000
+
+    with pytest.raises(ValueError):
+        env.ray_tracing([-1e3], [0], [-0.01], [0], 10, 0)
+
+
+def test_adaptive_reaches_boundary(tmp_path):
+    """An adaptive ray leaving the domain gets as close to the edge as with a
+    fixed step, even after its time step has grown long
+    """
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    env = mantaray.RayEnvironment(tmp_path / "island.nc", tmp_path / "current.nc")
+
+    fixed = env.single_ray(-1000, 0, -0.01, 0, 1e4, 1)
+    adaptive = env.single_ray(-1000, 0, -0.01, 0, 1e4, 1, rtol=1e-6)
+
+    fixed_x = fixed.x.dropna("time_step")[-1]
+    adaptive_x = adaptive.x.dropna("time_step")[-1]
+    assert fixed_x < -9_900
+    assert adaptive_x <= fixed_x
+    assert adaptive_x < -1e4 + 1
+
+
+def test_ray_environment_reuse(tmp_path):
+    """A RayEnvironment can trace several times without reloading the fields"""
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    env = mantaray.RayEnvironment(tmp_path / "island.nc", tmp_path / "current.nc")
+
+    single = env.single_ray(-1000, 0, 0.01, 0, 10, 2)
+    bundle = env.ray_tracing(3 * [-1000], 3 * [0], 3 * [0.01], 3 * [0], 10, 2)
+
+    assert single.sizes["time_step"] == 6
+    assert bundle.sizes["ray"] == 3
+    np.testing.assert_allclose(bundle.x.isel(ray=0), single.x)
+
+
+def test_environment_cache(tmp_path):
+    """Rewriting a file replaces its cached fields instead of adding a copy"""
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    mantaray.clear_cache()
+    env = mantaray.RayEnvironment(tmp_path / "island.nc", tmp_path / "current.nc")
+    same = mantaray.RayEnvironment(
+        f"{tmp_path}/./island.nc", f"{tmp_path}/./current.nc"
+    )
+    assert same._env is env._env
+    assert len(core._ENVIRONMENT_CACHE) == 1
+
+    ds = deep_water_constant_depth()
+    ds["depth"] = ds.depth / 2
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+    os.utime(tmp_path / "island.nc", ns=(0, 0))
+
+    updated = mantaray.RayEnvironment(tmp_path / "island.nc", tmp_path / "current.nc")
+    assert updated._env is not env._env
+    assert len(core._ENVIRONMENT_CACHE) == 1
+
+    mantaray.clear_cache()
+    assert len(core._ENVIRONMENT_CACHE) == 0
+
+
+def test_multiple_rays_n_threads(tmp_path):
+    """The number of threads doesn't change the result"""
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    env = mantaray.RayEnvironment(tmp_path / "island.nc", tmp_path / "current.nc")
+    y0 = np.linspace(-500, 500, 20)
+
+    serial = env.ray_tracing(
+        20 * [-1000], y0, 20 * [0.01], 20 * [0], 10, 2, n_threads=1
+    )
+    parallel = env.ray_tracing(20 * [-1000], y0, 20 * [0.01], 20 * [0], 10, 2)
+
+    xr.testing.assert_equal(serial, parallel)
+
+    # 0 means the default, and more threads than cores are accepted
+    for n_threads in (0, 64):
+        ds = env.ray_tracing(
+            20 * [-1000], y0, 20 * [0.01], 20 * [0], 10, 2, n_threads=n_threads
+        )
+        xr.testing.assert_equal(ds, parallel)
+        ds = env.ray_tracing(
+            20 * [-1000],
+            y0,
+            20 * [0.01],
+            20 * [0],
+            10,
+            2,
+            rtol=1e-6,
+            n_threads=n_threads,
+        )
+        assert ds.sizes["ray"] == 20
+
+
+def test_single_precision_output(tmp_path):
+    """Output can be downcast to float32"""
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    env = mantaray.RayEnvironment(tmp_path / "island.nc", tmp_path / "current.nc")
+
+    ds = env.single_ray(-1000, 0, 0.01, 0, 10, 2, output_dtype=np.float32)
+    assert ds.x.dtype == np.float32
+
+    ds = env.ray_tracing(
+        3 * [-1000], 3 * [0], 3 * [0.01], 3 * [0], 10, 2, output_dtype="float32"
+    )
+    assert ds.x.dtype == np.float32
+    assert ds.sizes["time_step"] == 6
+
+
+def test_output_attrs(tmp_path):
+    """Default attributes can be replaced, or skipped with an empty dict"""
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    env = mantaray.RayEnvironment(tmp_path / "island.nc", tmp_path / "current.nc")
+
+    ds = env.single_ray(-1000, 0, 0.01, 0, 10, 2)
+    assert "date_created" in ds.attrs
+
+    ds = env.ray_tracing(3 * [-1000], 3 * [0], 3 * [0.01], 3 * [0], 10, 2, attrs={})
+    assert ds.attrs == {}
+
+
+def test_numba_backend(tmp_path):
+    """The numba fallback gives the same rays as the default backend"""
+    pytest.importorskip("numba")
+    from mantaray import _numba_backend
+
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    env = _numba_backend.RayEnvironment(
+        str(tmp_path / "island.nc"), str(tmp_path / "current.nc")
+    )
+    x0 = np.array([-1000.0, -1000.0])
+    t, x, y, kx, ky = env.ray_tracing(x0, np.zeros(2), [0.01, 0.02], np.zeros(2), 10, 2)
+
+    ds = mantaray.ray_tracing(
+        x0,
+        np.zeros(2),
+        [0.01, 0.02],
+        np.zeros(2),
+        10,
+        2,
+        str(tmp_path / "island.nc"),
+        str(tmp_path / "current.nc"),
+    )
+    np.testing.assert_allclose(x, ds.x)
+    np.testing.assert_allclose(kx, ds.kx)
+
+
+def test_fallback_without_extension(tmp_path, monkeypatch):
+    """Without the compiled extension, core uses the numba backend"""
+    pytest.importorskip("numba")
+    from mantaray import _numba_backend
+
+    ds = deep_water_constant_depth()
+    ds.to_netcdf(tmp_path / "island.nc", format="NETCDF3_CLASSIC")
+
+    ds = zero_current_field()
+    ds.to_netcdf(tmp_path / "current.nc", format="NETCDF3_CLASSIC")
+
+    bathymetry = str(tmp_path / "island.nc")
+    current = str(tmp_path / "current.nc")
+    single = mantaray.single_ray(-1000, 0, 0.01, 0, 10, 2, bathymetry, current)
+    bundle = mantaray.ray_tracing(
+        2 * [-1000], 2 * [0], [0.01, 0.02], 2 * [0], 10, 2, bathymetry, current
+    )
+
+    # a None entry in sys.modules makes the import raise ImportError, once the
+    # already imported extension is removed from the package
+    monkeypatch.setitem(sys.modules, "mantaray._mantaray", None)
+    monkeypatch.delattr(mantaray, "_mantaray", raising=False)
+    try:
+        fallback = importlib.reload(core)
+        assert fallback._mantaray is _numba_backend
+
+        ds = fallback.single_ray(-1000, 0, 0.01, 0, 10, 2, bathymetry, current)
+        xr.testing.assert_allclose(ds, single)
+
+        ds = fallback.ray_tracing(
+            2 * [-1000], 2 * [0], [0.01, 0.02], 2 * [0], 10, 2, bathymetry, current
+        )
+        xr.testing.assert_allclose(ds, bundle)
+    finally:
+        monkeypatch.undo()
+        importlib.reload(core)
@@ -11,7 +11,6 @@ use super::BathymetryData;
 use crate::{
     datatype::{Gradient, Point},
     error::{Error, Result},
-    interpolator,
 };
 
 /// A struct that stores a netcdf3 dataset with methods to access, find nearest
@@ -20,7 +19,7 @@ use crate::{
 /// # Example
 /// Open the cartesian NetCDF3 file located at `path` with dimension names "x"
 /// and "y" and variable "depth".
-/// 
+///
 /// let data = CartesianNetcdf3::open(&path, "x", "y", "depth").unwrap();
 ///
 /// # Note
@@ -59,9 +58,7 @@ impl BathymetryData for CartesianNetcdf3 {
     ///
     /// # Errors
     /// - `Error::IndexOutOfBounds` : this error is returned when the `x` or `y`
-    /// input give an out of bounds output during the `interpolate` method.
-    /// - `Error::InvalidArgument` : this error is returned from
-    ///   `interpolator::bilinear` due to incorrect argument passed.
+    /// input give an out of bounds output.
     fn depth(&self, point: &Point<f32>) -> Result<f32> {
         let x = point.x();
         let y = point.y();
@@ -69,11 +66,9 @@ impl BathymetryData for CartesianNetcdf3 {
             return Ok(f32::NAN);
         }
 
-        let corner_points = match self.four_corners(x, y) {
-            Ok(point) => point,
-            Err(e) => return Err(e),
-        };
-        self.interpolate(&corner_points, &(*x, *y))
+        let (i, j, fx, fy) = self.cell(x, y)?;
+        let corners = self.corner_depths(i, j)?;
+        Ok(bilinear(&corners, fx, fy) as f32)
     }
 
     /// Depth and gradient at the given (x ,y) coordinate.
@@ -93,8 +88,6 @@ impl BathymetryData for CartesianNetcdf3 {
     /// # Errors
     /// - `Error::IndexOutOfBounds` : this error is returned when the
     /// `x` or `y` input give an out of bounds output.
-    /// - `Error::InvalidArgument` : this error is returned from
-    ///   `interpolator::bilinear` due to incorrect argument passed.
     fn depth_and_gradient(&self, point: &Point<f32>) -> Result<(f32, Gradient<f32>)> {
         let x = point.x();
         let y = point.y();
@@ -102,13 +95,11 @@ impl BathymetryData for CartesianNetcdf3 {
             return Ok((f32::NAN, Gradient::new(f32::NAN, f32::NAN)));
         }
 
-        let corner_points = match self.four_corners(x, y) {
-            Ok(point) => point,
-            Err(e) => return Err(e),
-        };
+        let (i, j, fx, fy) = self.cell(x, y)?;
+        let corners = self.corner_depths(i, j)?;
 
         // interpolate the depth
-        let depth = self.interpolate(&corner_points, &(*x, *y))?;
+        let depth = bilinear(&corners, fx, fy);
 
         // get the gradient
 
@@ -119,19 +110,14 @@ impl BathymetryData for CartesianNetcdf3 {
         let x_space = self.x[1] as f64 - self.x[0] as f64;
         let y_space = self.y[1] as f64 - self.y[0] as f64;
 
-        let sw_point = &corner_points[0];
-        let nw_point = &corner_points[1];
-        let se_point = &corner_points[3];
-
-        let x_gradient = (self.depth_at_indexes(&se_point.0, &se_point.1)?
-            - self.depth_at_indexes(&sw_point.0, &sw_point.1)?)
-            / x_space;
-
-        let y_gradient = (self.depth_at_indexes(&nw_point.0, &nw_point.1)?
-            - self.depth_at_indexes(&sw_point.0, &sw_point.1)?)
-            / y_space;
+        let [sw, se, nw, _] = corners;
+        let x_gradient = (se - sw) / x_space;
+        let y_gradient = (nw - sw) / y_space;
 
-        Ok((depth, Gradient::new(x_gradient as f32, y_gradient as f32)))
+        Ok((
+            depth as f32,
+            Gradient::new(x_gradient as f32, y_gradient as f32),
+        ))
     }
 }
 
@@ -318,159 +304,91 @@ impl CartesianNetcdf3 {
         Ok((xindex, yindex))
     }
 
-    /// Get four adjacent points
+    /// Grid cell containing the given (x, y) point
     ///
     /// # Arguments
-    /// `xindex` : `&usize`
-    /// - index of the x location
+    /// `x`: `&f32`
+    /// - x location in meters
     ///
-    /// `yindex` : `&usize`
-    /// - index of the y location
+    /// `y`: `&f32`
+    /// - y location in meters
     ///
     /// # Returns
-    /// `Result<Vec<(usize, usize)>>`: returns a vector of the 4 points
-    /// surrounding the target point. The points are in clockwise order starting
-    /// with the bottom left point. Or it will return an out of bounds error.
-    fn four_corners(&self, x: &f32, y: &f32) -> Result<Vec<(usize, usize)>> {
+    /// `Result<(usize, usize, f64, f64)>`: the (xindex, yindex) of the bottom
+    /// left corner of the cell and the fractional position (0 to 1) of the
+    /// point inside that cell in the x and y directions. Or it will return an
+    /// out of bounds error.
+    ///
+    /// # Note
+    /// The lower corner is clamped so that points on the right or top edge use
+    /// the last cell with a fraction of 1. This keeps the four corners inside
+    /// the grid without checking each edge separately.
+    fn cell(&self, x: &f32, y: &f32) -> Result<(usize, usize, f64, f64)> {
         let (xindex, yindex) = self.nearest_point(x, y)?;
 
-        // determine the edges
-        let xlow = 0.0;
-        let xhigh = (self.x.len() - 1) as f32;
-        let ylow = 0.0;
-        let yhigh = (self.y.len() - 1) as f32;
-
-        // check edges, interior points, or normal case
-        let (x1, x2) = if xindex == xlow {
-            // left edge
-            let x1 = xindex as usize;
-            let x2 = xindex as usize + 1;
-            (x1, x2)
-        } else if xindex == xhigh {
-            // right edge
-            let x1 = xindex as usize - 1;
-            let x2 = xindex as usize;
-            (x1, x2)
-        } else if xindex.fract() == 0.0 {
-            // on x grid point, but not on edge
-            let x1 = xindex.round() as usize;
-            let x2 = x1 + 1;
-            (x1, x2)
-        } else {
-            // normal case
-            let x1 = xindex.floor() as usize;
-            let x2 = xindex.ceil() as usize;
-            (x1, x2)
-        };
-
-        // check edges, interior points, or normal case
-        let (y1, y2) = if yindex == ylow {
-            // bottom edge
-            let y1 = yindex as usize;
-            let y2 = yindex as usize + 1;
-            (y1, y2)
-        } else if yindex == yhigh {
-            // top edge
-            let y1 = yindex as usize - 1;
-            let y2 = yindex as usize;
-            (y1, y2)
-        } else if yindex.fract() == 0.0 {
-            // on y grid point, but not edge
-            let y1 = yindex.round() as usize;
-            let y2 = y1 + 1;
-            (y1, y2)
-        } else {
-            // normal case
-            let y1 = yindex.floor() as usize;
-            let y2 = yindex.ceil() as usize;
-            (y1, y2)
-        };
-
-        Ok(vec![(x1, y1), (x1, y2), (x2, y2), (x2, y1)])
-    }
+        let i = (xindex as usize).min(self.x.len().saturating_sub(2));
+        let j = (yindex as usize).min(self.y.len().saturating_sub(2));
 
-    /// Interpolate the depth using crate::interpolator::bilinear
-    ///
-    /// First, the index points are converted to the x and y values at those
-    /// indexes, then the depth at that index is taken. Finally, these are used
-    /// as arguments to `interpolator::bilinear`.
-    ///
-    /// # Arguments
-    /// `index_points`: `&Vec<(usize, usize)>`
-    /// - a vector of (x_index, y_index) points representing the indices of the
-    ///   corners that the target location is within.
-    ///
-    /// `target`: `&(f32, f32)`
-    /// - interpolate the depth at this (x, y) point
-    ///
-    /// # Returns
-    /// `Result<f32>`
-    /// - `Ok(f32)` : the depth at the target point
-    /// - `Err(Error)` : cannot read depths from at coordinates in the `points`
-    ///   vector.
-    ///
-    /// # Errors
-    /// - `Error::IndexOutOfBounds` : one or more of the points passed to
-    /// `points` is out of bounds.
-    /// - `Error::InvalidArgument` : error during execution of
-    /// `interpolator::bilinear` due to invalid arguments.
-    fn interpolate(
-        &self,
-        index_points: &[(usize, usize)],
-        target_point: &(f32, f32),
-    ) -> Result<f32> {
-        let depth_points = vec![
-            (
-                self.x[index_points[0].0],
-                self.y[index_points[0].1],
-                self.depth_at_indexes(&index_points[0].0, &index_points[0].1)? as f32,
-            ),
-            (
-                self.x[index_points[1].0],
-                self.y[index_points[1].1],
-                self.depth_at_indexes(&index_points[1].0, &index_points[1].1)? as f32,
-            ),
-            (
-                self.x[index_points[2].0],
-                self.y[index_points[2].1],
-                self.depth_at_indexes(&index_points[2].0, &index_points[2].1)? as f32,
-            ),
-            (
-                self.x[index_points[3].0],
-                self.y[index_points[3].1],
-                self.depth_at_indexes(&index_points[3].0, &index_points[3].1)? as f32,
-            ),
-        ];
-        interpolator::bilinear(&depth_points, target_point)
+        Ok((i, j, (xindex - i as f32) as f64, (yindex - j as f32) as f64))
     }
 
-    /// Access values in flattened array as you would a 2d array
+    /// Depth at the four corners of a grid cell
     ///
     /// # Arguments
-    /// `x_index` : `&usize`
-    /// - index of location in x array (column)
+    /// `xindex` : `usize`
+    /// - x index of the bottom left corner of the cell (column)
     ///
-    /// `y_index` : `&usize`
-    /// - index of location in y array (row)
+    /// `yindex` : `usize`
+    /// - y index of the bottom left corner of the cell (row)
     ///
     /// # Returns
-    /// `Result<f32>`
-    /// - `Ok(f32)` : depth
-    /// - `Err(Error::IndexOutOfBounds)` : the combined index (x_length *
-    ///   y_index + x_index) is out of bounds of the depth array.
+    /// `Result<[f64; 4]>`
+    /// - `Ok([f64; 4])` : the depths at the bottom left, bottom right, top
+    ///   left, and top right corners.
+    /// - `Err(Error::IndexOutOfBounds)` : the cell extends outside of the
+    ///   depth array.
     ///
-    /// # Errors
-    /// `Err(Error::IndexOutOfBounds)` : this error is returned when `x_index`
-    /// and `y_index` produce a value outside of the depth array.
-    fn depth_at_indexes(&self, xindex: &usize, yindex: &usize) -> Result<f64> {
-        let index = self.x.len() * yindex + xindex;
-        if index >= self.depth.len() {
+    /// # Note
+    /// The depth array is flattened with x varying fastest, so the four corners
+    /// are found from a single offset (x_length * yindex + xindex) and a single
+    /// bounds check.
+    fn corner_depths(&self, xindex: usize, yindex: usize) -> Result<[f64; 4]> {
+        let nx = self.x.len();
+        let sw = nx * yindex + xindex;
+        let ne = sw + nx + 1;
+        if ne >= self.depth.len() {
             return Err(Error::IndexOutOfBounds);
         }
-        Ok(self.depth[index])
+        Ok([
+            self.depth[sw],
+            self.depth[sw + 1],
+            self.depth[sw + nx],
+            self.depth[ne],
+        ])
     }
 }
 
+/// Bilinear interpolation inside a rectangular grid cell
+///
+/// # Arguments
+/// `corners` : `&[f64; 4]`
+/// - values at the bottom left, bottom right, top left, and top right corners
+///
+/// `fx` : `f64`
+/// - fractional position (0 to 1) in the x direction
+///
+/// `fy` : `f64`
+/// - fractional position (0 to 1) in the y direction
+///
+/// # Returns
+/// `f64` : the interpolated value
+fn bilinear(corners: &[f64; 4], fx: f64, fy: f64) -> f64 {
+    let [sw, se, nw, ne] = *corners;
+    let south = sw + fx * (se - sw);
+    let north = nw + fx * (ne - nw);
+    south + fy * (north - south)
+}
+
 #[cfg(test)]
 mod test_cartesian_file {
 
@@ -560,8 +478,8 @@ mod test_cartesian_file {
     }
 
     #[test]
-    // check all the cases for the output from the four_corners function
-    fn test_get_corners() {
+    // check all the cases for the output from the cell function
+    fn test_get_cell() {
         // create temporary file
         let temp_file = NamedTempFile::new().unwrap();
         let temp_path = temp_file.into_temp_path();
@@ -570,92 +488,65 @@ mod test_cartesian_file {
 
         let data = CartesianNetcdf3::open(&temp_path, "x", "y", "depth").unwrap();
 
+        // index of the bottom left corner of the cell
+        let corner = |x: f32, y: f32| data.cell(&x, &y).map(|(i, j, _, _)| (i, j));
+
         // check edge cases
 
         // top left corner
-        assert!(
-            data.four_corners(&0.0, &25_000.0).unwrap() == vec![(0, 49), (0, 50), (1, 50), (1, 49)]
-        );
+        assert!(corner(0.0, 25_000.0).unwrap() == (0, 49));
 
         // left edge
-        assert!(
-            data.four_corners(&0.0, &5_500.0).unwrap() == vec![(0, 11), (0, 12), (1, 12), (1, 11)]
-        );
+        assert!(corner(0.0, 5_500.0).unwrap() == (0, 11));
 
         // bottom left corner
-        assert!(data.four_corners(&0.0, &0.0).unwrap() == vec![(0, 0), (0, 1), (1, 1), (1, 0)]);
+        assert!(corner(0.0, 0.0).unwrap() == (0, 0));
 
         // top edge
-        assert!(
-            data.four_corners(&5_500.0, &25_000.0).unwrap()
-                == vec![(11, 49), (11, 50), (12, 50), (12, 49)]
-        );
+        assert!(corner(5_500.0, 25_000.0).unwrap() == (11, 49));
 
         // bottom edge
-        assert!(
-            data.four_corners(&5_500.0, &0.0).unwrap() == vec![(11, 0), (11, 1), (12, 1), (12, 0)]
-        );
+        assert!(corner(5_500.0, 0.0).unwrap() == (11, 0));
 
         // top right corner
-        assert!(
-            data.four_corners(&50_000.0, &25_000.0).unwrap()
-                == vec![(99, 49), (99, 50), (100, 50), (100, 49)]
-        );
+        assert!(corner(50_000.0, 25_000.0).unwrap() == (99, 49));
 
         // right edge
-        assert!(
-            data.four_corners(&50_000.0, &5_500.0).unwrap()
-                == vec![(99, 11), (99, 12), (100, 12), (100, 11)]
-        );
+        assert!(corner(50_000.0, 5_500.0).unwrap() == (99, 11));
 
         // bottom right corner
-        assert!(
-            data.four_corners(&50_000.0, &0.0).unwrap()
-                == vec![(99, 0), (99, 1), (100, 1), (100, 0)]
-        );
+        assert!(corner(50_000.0, 0.0).unwrap() == (99, 0));
 
         // check out of bounds
         // check out of bounds
-        assert!(match data.four_corners(&50_001.0, &0.0) {
+        assert!(match data.cell(&50_001.0, &0.0) {
             Err(Error::IndexOutOfBounds) => true,
             _ => false,
         });
-        assert!(match data.four_corners(&50_000.0, &25_001.0) {
+        assert!(match data.cell(&50_000.0, &25_001.0) {
             Err(Error::IndexOutOfBounds) => true,
             _ => false,
         });
-        assert!(match data.four_corners(&-1.0, &0.0) {
+        assert!(match data.cell(&-1.0, &0.0) {
             Err(Error::IndexOutOfBounds) => true,
             _ => false,
         });
-        assert!(match data.four_corners(&50_000.0, &-1.0) {
+        assert!(match data.cell(&50_000.0, &-1.0) {
             Err(Error::IndexOutOfBounds) => true,
             _ => false,
         });
 
         // check not edge, in bounds, and both x and y on grid point
-        assert!(
-            data.four_corners(&5_500.0, &5_500.0).unwrap()
-                == vec![(11, 11), (11, 12), (12, 12), (12, 11)]
-        );
+        assert!(corner(5_500.0, 5_500.0).unwrap() == (11, 11));
 
         // check not edge, in bounds, and only x on grid point
-        assert!(
-            data.four_corners(&5_500.0, &5_750.0).unwrap()
-                == vec![(11, 11), (11, 12), (12, 12), (12, 11)]
-        );
+        assert!(corner(5_500.0, 5_750.0).unwrap() == (11, 11));
 
         // check not edge, in bounds, and only y on grid point
-        assert!(
-            data.four_corners(&5_750.0, &5_500.0).unwrap()
-                == vec![(11, 11), (11, 12), (12, 12), (12, 11)]
-        );
+        assert!(corner(5_750.0, 5_500.0).unwrap() == (11, 11));
 
         // check not edge, in bounds, and not on a grid point
-        assert!(
-            data.four_corners(&5_750.0, &5_750.0).unwrap()
-                == vec![(11, 11), (11, 12), (12, 12), (12, 11)]
-        );
+        assert!(corner(5_750.0, 5_750.0).unwrap() == (11, 11));
     }
 
     #[test]
@@ -1,107 +1,230 @@
-#![allow(unused)]
-
-// extern crate std;
-use std::ffi::CStr;
-use std::os::raw::c_char;
 use std::path::Path;
-use std::str;
 
-use ode_solvers::dop_shared::SolverResult;
+use ndarray::Array2;
+use numpy::{IntoPyArray, PyReadonlyArray1};
+use pyo3::exceptions::{PyIOError, PyRuntimeError, PyValueError};
 use pyo3::prelude::*;
 
 use crate::bathymetry::CartesianNetcdf3;
 use crate::current::CartesianCurrent;
-use crate::datatype::{Point, Ray, RayState, WaveNumber};
-use crate::ray::{ManyRays, SingleRay};
+use crate::datatype::{Point, RayState, WaveNumber};
+use crate::ray::SingleRay;
+use crate::ray_batch::{BatchResult, RayBatch, DEFAULT_ATOL, DEFAULT_RTOL};
 
 /// A Python module implemented in Rust.
 #[pymodule]
 fn _mantaray(m: &Bound<'_, PyModule>) -> PyResult<()> {
-    m.add_function(wrap_pyfunction!(single_ray, m)?)?;
-    m.add_function(wrap_pyfunction!(ray_tracing, m)?)?;
+    m.add_class::<RayEnvironment>()?;
     Ok(())
 }
 
-#[pyfunction]
-fn single_ray(
-    x0: f64,
-    y0: f64,
-    kx0: f64,
-    ky0: f64,
-    duration: f64,
-    step_size: f64,
-    bathymetry_filename: String,
-    current_filename: String,
-) -> PyResult<(Vec<(f64, f64, f64, f64, f64)>)> {
-    let bathymetry = CartesianNetcdf3::open(Path::new(&bathymetry_filename), "x", "y", "depth")
-        .expect("could not open bathymetry file");
-    let current = CartesianCurrent::open(Path::new(&current_filename), "x", "y", "u", "v");
-    let initial_state = RayState::new(Point::new(x0, y0), WaveNumber::new(kx0, ky0));
-    let wave = SingleRay::new(&bathymetry, &current, &initial_state);
-    let res = wave.trace_individual(0.0, duration, step_size).unwrap();
-    let (t, s) = res.get();
-    let ans: Vec<_> = t
-        .iter()
-        .zip(s.iter())
-        .map(|(t, s)| (*t, s[0], s[1], s[2], s[3]))
-        .collect();
-    Ok(ans)
+/// Output arrays with shape (ray, time_step) for (t, x, y, kx, ky)
+type BatchArrays<'py> = (
+    Bound<'py, PyAny>,
+    Bound<'py, PyAny>,
+    Bound<'py, PyAny>,
+    Bound<'py, PyAny>,
+    Bound<'py, PyAny>,
+);
+
+/// Convert an output array to numpy, downcasting to f32 if `float32`
+///
+/// The integration is always done in f64, only the output is stored in
+/// single precision.
+fn output_array(py: Python<'_>, a: Array2<f64>, float32: bool) -> Bound<'_, PyAny> {
+    if float32 {
+        a.mapv(|v| v as f32).into_pyarray(py).into_any()
+    } else {
+        a.into_pyarray(py).into_any()
+    }
 }
 
-#[pyfunction]
-fn ray_tracing(
-    x0: Vec<f64>,
-    y0: Vec<f64>,
-    kx0: Vec<f64>,
-    ky0: Vec<f64>,
-    duration: f64,
-    step_size: f64,
-    bathymetry_filename: String,
-    current_filename: String,
-) -> PyResult<(Vec<Vec<(f64, f64, f64, f64, f64)>>)> {
-    let bathymetry = CartesianNetcdf3::open(Path::new(&bathymetry_filename), "x", "y", "depth")
-        .expect("could not open bathymetry file");
-    let current = CartesianCurrent::open(Path::new(&current_filename), "x", "y", "u", "v");
-    let init_cond = x0
-        .iter()
-        .zip(y0.iter())
-        .zip(kx0.iter().zip(ky0.iter()))
-        .map(|((x, y), (kx, ky))| RayState::new(Point::new(*x, *y), WaveNumber::new(*kx, *ky)))
-        .collect::<Vec<RayState<f64>>>();
-    let waves = ManyRays::new(&bathymetry, &current, &init_cond);
-    let res = waves.trace_many(0.0, duration, step_size);
-    let rays: Vec<Vec<(f64, f64, f64, f64, f64)>> = res
-        .iter()
-        .filter_map(|r| r.as_ref())
-        .map(|r| {
-            let (t, s) = r.get();
-            t.iter()
-                .zip(s.iter())
-                .map(|(t, s)| (*t, s[0], s[1], s[2], s[3]))
-                .collect::<Vec<_>>()
+/// Bathymetry and current loaded once and shared by many ray tracings
+///
+/// The NetCDF files are read when the environment is created, so that
+/// tracing more rays on the same fields doesn't read them again.
+#[pyclass]
+struct RayEnvironment {
+    /// bathymetry loaded from the NetCDF3 file
+    bathymetry: CartesianNetcdf3,
+    /// current loaded from the NetCDF3 file
+    current: CartesianCurrent,
+}
+
+#[pymethods]
+impl RayEnvironment {
+    #[new]
+    fn new(bathymetry_filename: String, current_filename: String) -> PyResult<Self> {
+        let bathymetry = CartesianNetcdf3::open(Path::new(&bathymetry_filename), "x", "y", "depth")
+            .map_err(|e| PyIOError::new_err(format!("could not open bathymetry file: {e}")))?;
+        let current = CartesianCurrent::open(Path::new(&current_filename), "x", "y", "u", "v");
+        Ok(RayEnvironment {
+            bathymetry,
+            current,
         })
-        .collect();
-    Ok(rays)
+    }
+
+    /// Trace a single ray
+    ///
+    /// The result is an array with shape (5, time_step) where the rows are
+    /// (t, x, y, kx, ky).
+    ///
+    /// If `rtol` or `atol` is given, the ray is integrated with an adaptive
+    /// time step, and `step_size` is only the initial time step.
+    ///
+    /// If `float32`, the output is returned in single precision.
+    #[pyo3(signature = (x0, y0, kx0, ky0, duration, step_size, rtol=None, atol=None, float32=false))]
+    fn single_ray<'py>(
+        &self,
+        py: Python<'py>,
+        x0: f64,
+        y0: f64,
+        kx0: f64,
+        ky0: f64,
+        duration: f64,
+        step_size: f64,
+        rtol: Option<f64>,
+        atol: Option<f64>,
+        float32: bool,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        check_step_size(step_size)?;
+        if rtol.is_some() || atol.is_some() {
+            let batch = RayBatch::new(&self.bathymetry, &self.current);
+            let out = trace_batch(
+                &batch,
+                &[x0],
+                &[y0],
+                &[kx0],
+                &[ky0],
+                duration,
+                step_size,
+                rtol,
+                atol,
+            );
+            let mut ans = Array2::zeros((5, out.t.ncols()));
+            for (k, v) in [&out.t, &out.x, &out.y, &out.kx, &out.ky]
+                .iter()
+                .enumerate()
+            {
+                ans.row_mut(k).assign(&v.row(0));
+            }
+            return Ok(output_array(py, ans, float32));
+        }
+        let initial_state = RayState::new(Point::new(x0, y0), WaveNumber::new(kx0, ky0));
+        let wave = SingleRay::new(&self.bathymetry, &self.current, &initial_state);
+        let res = wave.trace_individual(0.0, duration, step_size).unwrap();
+        let (t, s) = res.get();
+        let mut ans = Array2::zeros((5, t.len()));
+        for (j, (t, s)) in t.iter().zip(s.iter()).enumerate() {
+            ans[[0, j]] = *t;
+            for k in 0..4 {
+                ans[[k + 1, j]] = s[k];
+            }
+        }
+        Ok(output_array(py, ans, float32))
+    }
+
+    /// Trace a batch of rays in lockstep
+    ///
+    /// The initial conditions are contiguous arrays, one element per ray,
+    /// and the result is a tuple of arrays (t, x, y, kx, ky), each with
+    /// shape (ray, time_step). Rays that stop early, such as when leaving
+    /// the domain, are padded with NaN.
+    ///
+    /// If `rtol` or `atol` is given, each ray is integrated with an adaptive
+    /// time step instead, and `step_size` is only the initial time step.
+    ///
+    /// The rays are traced in parallel on `n_threads` threads, or on the
+    /// global rayon thread pool (one thread per core) if it is not given.
+    ///
+    /// If `float32`, the output is returned in single precision.
+    #[pyo3(signature = (x0, y0, kx0, ky0, duration, step_size, rtol=None, atol=None, n_threads=None, float32=false))]
+    fn ray_tracing<'py>(
+        &self,
+        py: Python<'py>,
+        x0: PyReadonlyArray1<'py, f64>,
+        y0: PyReadonlyArray1<'py, f64>,
+        kx0: PyReadonlyArray1<'py, f64>,
+        ky0: PyReadonlyArray1<'py, f64>,
+        duration: f64,
+        step_size: f64,
+        rtol: Option<f64>,
+        atol: Option<f64>,
+        n_threads: Option<usize>,
+        float32: bool,
+    ) -> PyResult<BatchArrays<'py>> {
+        let (x0, y0, kx0, ky0) = (
+            x0.as_slice()?,
+            y0.as_slice()?,
+            kx0.as_slice()?,
+            ky0.as_slice()?,
+        );
+        if y0.len() != x0.len() || kx0.len() != x0.len() || ky0.len() != x0.len() {
+            return Err(PyValueError::new_err(
+                "initial conditions must have the same length",
+            ));
+        }
+        check_step_size(step_size)?;
+
+        let batch = RayBatch::new(&self.bathymetry, &self.current);
+        let trace = || trace_batch(&batch, x0, y0, kx0, ky0, duration, step_size, rtol, atol);
+        let out = py
+            .allow_threads(|| match n_threads {
+                None => Ok(trace()),
+                Some(n) => rayon::ThreadPoolBuilder::new()
+                    .num_threads(n)
+                    .build()
+                    .map(|pool| pool.install(trace)),
+            })
+            .map_err(|e| PyRuntimeError::new_err(format!("could not start threads: {e}")))?;
+        Ok((
+            output_array(py, out.t, float32),
+            output_array(py, out.x, float32),
+            output_array(py, out.y, float32),
+            output_array(py, out.kx, float32),
+            output_array(py, out.ky, float32),
+        ))
+    }
 }
 
-/*
-#[no_mangle]
-pub unsafe extern "C" fn single_ray(
-    bathymetry_path: *const c_char,
-    x0: f64,
-    y0: f64,
-    kx0: f64,
-    ky0: f64,
-    end_time: f64,
+/// Reject a `step_size` that is not positive and finite, before it is used
+/// to size the output.
+fn check_step_size(step_size: f64) -> PyResult<()> {
+    if step_size > 0.0 && step_size.is_finite() {
+        Ok(())
+    } else {
+        Err(PyValueError::new_err(
+            "step_size must be positive and finite",
+        ))
+    }
+}
+
+/// Trace with a fixed time step, or with an adaptive one if any of the
+/// tolerances is given. The missing tolerance takes its default value.
+fn trace_batch(
+    batch: &RayBatch,
+    x0: &[f64],
+    y0: &[f64],
+    kx0: &[f64],
+    ky0: &[f64],
+    duration: f64,
     step_size: f64,
-) -> i32 {
-    let bytes = unsafe { CStr::from_ptr(bathymetry_path).to_bytes() };
-    let str_slice = str::from_utf8(bytes).unwrap();
-    let path = Path::new(str_slice);
-    let bathymetry = CartesianFile::new(path);
-    let wave = SingleRay::new(&bathymetry, x0, y0, kx0, ky0);
-    let res = wave.trace_individual(0.0, end_time, step_size).unwrap();
-    dbg!(&res);
-    42
+    rtol: Option<f64>,
+    atol: Option<f64>,
+) -> BatchResult {
+    if rtol.is_none() && atol.is_none() {
+        batch.trace(x0, y0, kx0, ky0, 0.0, duration, step_size)
+    } else {
+        batch.trace_adaptive(
+            x0,
+            y0,
+            kx0,
+            ky0,
+            0.0,
+            duration,
+            step_size,
+            rtol.unwrap_or(DEFAULT_RTOL),
+            atol.unwrap_or(DEFAULT_ATOL),
+        )
+    }
 }
-*/
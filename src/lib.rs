@@ -31,6 +31,7 @@ mod ffi;
 mod interpolator;
 mod io;
 mod ray;
+mod ray_batch;
 mod ray_result;
 #[cfg(test)]
 mod tests;
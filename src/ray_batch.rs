@@ -0,0 +1,872 @@
+//! Lockstep integration of a batch of rays.
+//!
+//! `ManyRays` integrates each ray independently with `ode_solvers` and
+//! returns one `SolverResult` per ray, which then has to be padded to a
+//! common length before it can be used as a (ray, time_step) array. The
+//! `RayBatch` struct instead keeps the state of all the rays as a structure
+//! of arrays (x, y, kx, ky) and advances every ray with the same classic
+//! Runge-Kutta 4 step, so that the output is already a regular array.
+//!
+//! The output is also a structure of arrays, one (ray, time_step) array per
+//! variable, which maps directly to the variables of an xarray Dataset.
+//!
+//! Alternatively, `RayBatch::trace_adaptive` integrates each ray with an
+//! embedded Runge-Kutta-Cash-Karp 5(4) scheme and its own adaptive time
+//! step, taking long steps where the bathymetry and current are smooth and
+//! short ones where they are not.
+//!
+//! Rays are independent of each other, so both methods spread the work over
+//! the rayon thread pool: the lockstep integration in chunks of `CHUNK` rays
+//! and the adaptive one ray by ray.
+
+use ndarray::{s, Array2};
+use rayon::prelude::*;
+
+use crate::bathymetry::BathymetryData;
+use crate::current::CurrentData;
+use crate::wave_ray_path::WaveRayPath;
+
+/// number of rays integrated in lockstep by each rayon task
+const CHUNK: usize = 8;
+
+/// default relative tolerance for the adaptive time step
+pub(crate) const DEFAULT_RTOL: f64 = 1e-6;
+
+/// default absolute tolerance for the adaptive time step
+pub(crate) const DEFAULT_ATOL: f64 = 1e-9;
+
+/// safety factor applied to the optimal adaptive time step
+const SAFETY: f64 = 0.9;
+
+/// the adaptive time step never grows by more than this factor in one step
+const MAX_FACTOR: f64 = 5.0;
+
+/// the adaptive time step never shrinks by more than this factor in one step
+const MIN_FACTOR: f64 = 0.1;
+
+/// smallest adaptive time step, as a fraction of the initial step size. A
+/// step this small is accepted regardless of the error estimate.
+const MIN_STEP_FRACTION: f64 = 1e-6;
+
+/// most time steps reserved for the output before the integration starts.
+/// Rays usually leave the domain long before the end time, so longer paths
+/// grow their buffers as they go instead of reserving the whole duration.
+const INITIAL_RECORDS: usize = 1024;
+
+/// Panics if `step_size` is not positive and finite
+fn check_step_size(step_size: f64) {
+    assert!(
+        step_size > 0.0 && step_size.is_finite(),
+        "step_size must be positive and finite"
+    );
+}
+
+/// Number of time steps from `start_time` to `end_time`
+///
+/// # Panics
+/// If `step_size` is not positive and finite.
+fn num_steps(start_time: f64, end_time: f64, step_size: f64) -> usize {
+    check_step_size(step_size);
+    ((end_time - start_time) / step_size).ceil() as usize
+}
+
+/// Structure of arrays holding one component of the ray state per vector.
+///
+/// Element `i` of each vector belongs to the ray `i` of the batch.
+#[derive(Clone, Debug, PartialEq)]
+struct BatchState {
+    x: Vec<f64>,
+    y: Vec<f64>,
+    kx: Vec<f64>,
+    ky: Vec<f64>,
+}
+
+impl BatchState {
+    /// create a state for `n` rays filled with zeros
+    fn zeros(n: usize) -> Self {
+        BatchState {
+            x: vec![0.0; n],
+            y: vec![0.0; n],
+            kx: vec![0.0; n],
+            ky: vec![0.0; n],
+        }
+    }
+
+    /// set `self = base + h * ds` for every component of every ray
+    fn axpy(&mut self, base: &BatchState, h: f64, ds: &BatchState) {
+        axpy(&mut self.x, &base.x, h, &ds.x);
+        axpy(&mut self.y, &base.y, h, &ds.y);
+        axpy(&mut self.kx, &base.kx, h, &ds.kx);
+        axpy(&mut self.ky, &base.ky, h, &ds.ky);
+    }
+}
+
+/// `out[i] = base[i] + h * ds[i]`, written as a plain loop over contiguous
+/// slices so that it can be auto-vectorized.
+fn axpy(out: &mut [f64], base: &[f64], h: f64, ds: &[f64]) {
+    for ((o, b), d) in out.iter_mut().zip(base).zip(ds) {
+        *o = b + h * d;
+    }
+}
+
+/// Result of `RayBatch::trace`, one array with shape (ray, time_step) per
+/// variable.
+pub(crate) struct BatchResult {
+    /// time \[s\]
+    pub(crate) t: Array2<f64>,
+    /// x coordinate \[m\]
+    pub(crate) x: Array2<f64>,
+    /// y coordinate \[m\]
+    pub(crate) y: Array2<f64>,
+    /// x component of the wavenumber \[m^-1\]
+    pub(crate) kx: Array2<f64>,
+    /// y component of the wavenumber \[m^-1\]
+    pub(crate) ky: Array2<f64>,
+}
+
+/// Integrates many rays in lockstep over the same bathymetry and current.
+pub(crate) struct RayBatch<'a> {
+    /// the system of odes shared by all the rays of the batch
+    system: WaveRayPath<'a>,
+}
+
+#[allow(dead_code)]
+impl<'a> RayBatch<'a> {
+    /// construct a new `RayBatch`
+    ///
+    /// # Arguments
+    /// `bathymetry_data`: `&'a dyn BathymetryData`
+    /// - the data on depth that implements the `depth` and
+    ///   `depth_gradient` methods.
+    ///
+    /// `current_data`: `&'a dyn CurrentData`
+    /// - the data on current that implements the `current_and_gradient`
+    ///   method.
+    ///
+    /// # Returns
+    /// `Self`: a constructed `RayBatch` struct
+    pub(crate) fn new(
+        bathymetry_data: &'a dyn BathymetryData,
+        current_data: &'a dyn CurrentData,
+    ) -> Self {
+        RayBatch {
+            system: WaveRayPath::new(bathymetry_data, current_data),
+        }
+    }
+
+    /// Evaluate the derivatives of every active ray
+    ///
+    /// Rays that are no longer active, or for which the odes return an error
+    /// (e.g. out of the domain), get NaN derivatives.
+    fn derivatives(&self, s: &BatchState, active: &[bool], ds: &mut BatchState) {
+        for i in 0..active.len() {
+            let d = if active[i] {
+                self.system
+                    .odes(&s.x[i], &s.y[i], &s.kx[i], &s.ky[i])
+                    .unwrap_or((f64::NAN, f64::NAN, f64::NAN, f64::NAN))
+            } else {
+                (f64::NAN, f64::NAN, f64::NAN, f64::NAN)
+            };
+            ds.x[i] = d.0;
+            ds.y[i] = d.1;
+            ds.kx[i] = d.2;
+            ds.ky[i] = d.3;
+        }
+    }
+
+    /// Trace all the rays from `start_time` to `end_time` with a fixed step
+    ///
+    /// The rays are split in chunks of `CHUNK` rays which are traced in
+    /// parallel, each one in lockstep.
+    ///
+    /// # Arguments
+    /// `x0`, `y0`, `kx0`, `ky0` : `&[f64]`
+    /// - initial conditions, one element per ray. All four slices must have
+    ///   the same length.
+    ///
+    /// `start_time`: `f64`
+    /// - the time the ray tracing begins.
+    ///
+    /// `end_time`: `f64`
+    /// - the time the ray tracing is stopped.
+    ///
+    /// `step_size`: `f64`
+    /// - the change in time between integration steps.
+    ///
+    /// # Returns
+    /// `BatchResult` : the t, x, y, kx, and ky arrays, each with shape
+    /// (ray, time_step). Once a ray reaches a NaN state, such as when leaving
+    /// the domain, that and all the following time steps of the ray are NaN.
+    /// The time_step axis is trimmed to the last valid state of the longest
+    /// ray.
+    ///
+    /// # Panics
+    /// If the initial conditions do not have the same length, or if
+    /// `step_size` is not positive and finite.
+    pub(crate) fn trace(
+        &self,
+        x0: &[f64],
+        y0: &[f64],
+        kx0: &[f64],
+        ky0: &[f64],
+        start_time: f64,
+        end_time: f64,
+        step_size: f64,
+    ) -> BatchResult {
+        let n_rays = x0.len();
+        assert!(
+            y0.len() == n_rays && kx0.len() == n_rays && ky0.len() == n_rays,
+            "initial conditions must have the same length"
+        );
+
+        let num_steps = num_steps(start_time, end_time, step_size);
+
+        let chunks: Vec<BatchResult> = x0
+            .par_chunks(CHUNK)
+            .zip(y0.par_chunks(CHUNK))
+            .zip(kx0.par_chunks(CHUNK))
+            .zip(ky0.par_chunks(CHUNK))
+            .map(|(((x0, y0), kx0), ky0)| {
+                self.trace_chunk(x0, y0, kx0, ky0, start_time, num_steps, step_size)
+            })
+            .collect();
+        stack(&chunks, n_rays)
+    }
+
+    /// Trace a chunk of rays in lockstep with a fixed step
+    ///
+    /// Same arguments and output as `trace`, but for a single chunk of rays
+    /// advanced together by the same Runge-Kutta 4 step, for at most
+    /// `num_steps` steps.
+    fn trace_chunk(
+        &self,
+        x0: &[f64],
+        y0: &[f64],
+        kx0: &[f64],
+        ky0: &[f64],
+        start_time: f64,
+        num_steps: usize,
+        step_size: f64,
+    ) -> BatchResult {
+        let n_rays = x0.len();
+
+        let mut state = BatchState {
+            x: x0.to_vec(),
+            y: y0.to_vec(),
+            kx: kx0.to_vec(),
+            ky: ky0.to_vec(),
+        };
+        let mut active: Vec<bool> = (0..n_rays)
+            .map(|i| !(x0[i].is_nan() || y0[i].is_nan() || kx0[i].is_nan() || ky0[i].is_nan()))
+            .collect();
+
+        let mut tmp = BatchState::zeros(n_rays);
+        let mut k1 = BatchState::zeros(n_rays);
+        let mut k2 = BatchState::zeros(n_rays);
+        let mut k3 = BatchState::zeros(n_rays);
+        let mut k4 = BatchState::zeros(n_rays);
+
+        // output stored as (t, x, y, kx, ky), each with (time_step, ray).
+        // The initial reservation is capped, longer paths grow the buffers
+        // geometrically as records are appended.
+        let capacity = (num_steps + 1).min(INITIAL_RECORDS) * n_rays;
+        let mut history: [Vec<f64>; 5] = [(); 5].map(|_| Vec::with_capacity(capacity));
+        record(&mut history, start_time, &state, &active);
+
+        for step in 1..=num_steps {
+            if !active.iter().any(|a| *a) {
+                break;
+            }
+
+            self.derivatives(&state, &active, &mut k1);
+            tmp.axpy(&state, step_size / 2.0, &k1);
+            self.derivatives(&tmp, &active, &mut k2);
+            tmp.axpy(&state, step_size / 2.0, &k2);
+            self.derivatives(&tmp, &active, &mut k3);
+            tmp.axpy(&state, step_size, &k3);
+            self.derivatives(&tmp, &active, &mut k4);
+
+            for i in 0..n_rays {
+                k1.x[i] += 2.0 * (k2.x[i] + k3.x[i]) + k4.x[i];
+                k1.y[i] += 2.0 * (k2.y[i] + k3.y[i]) + k4.y[i];
+                k1.kx[i] += 2.0 * (k2.kx[i] + k3.kx[i]) + k4.kx[i];
+                k1.ky[i] += 2.0 * (k2.ky[i] + k3.ky[i]) + k4.ky[i];
+            }
+            tmp.axpy(&state, step_size / 6.0, &k1);
+            std::mem::swap(&mut state, &mut tmp);
+
+            for (i, a) in active.iter_mut().enumerate() {
+                if state.x[i].is_nan()
+                    || state.y[i].is_nan()
+                    || state.kx[i].is_nan()
+                    || state.ky[i].is_nan()
+                {
+                    *a = false;
+                }
+            }
+            if !active.iter().any(|a| *a) {
+                break;
+            }
+
+            record(
+                &mut history,
+                start_time + step as f64 * step_size,
+                &state,
+                &active,
+            );
+        }
+
+        // the (ray, time_step) arrays are transposed views of the buffers,
+        // `stack` copies them into the final standard layout
+        let n_records = history[0].len() / n_rays.max(1);
+        let [t, x, y, kx, ky] = history.map(|h| {
+            Array2::from_shape_vec((n_records, n_rays), h)
+                .expect("history has one record per ray per time step")
+                .reversed_axes()
+        });
+        BatchResult { t, x, y, kx, ky }
+    }
+
+    /// Trace all the rays from `start_time` to `end_time` with an adaptive
+    /// time step
+    ///
+    /// Each ray is integrated with its own time step, controlled by the
+    /// error estimate of the embedded Runge-Kutta-Cash-Karp 5(4) method, thus
+    /// the time steps are not uniform and differ between rays.
+    ///
+    /// # Arguments
+    /// `x0`, `y0`, `kx0`, `ky0` : `&[f64]`
+    /// - initial conditions, one element per ray. All four slices must have
+    ///   the same length.
+    ///
+    /// `start_time`: `f64`
+    /// - the time the ray tracing begins.
+    ///
+    /// `end_time`: `f64`
+    /// - the time the ray tracing is stopped.
+    ///
+    /// `step_size`: `f64`
+    /// - the initial time step.
+    ///
+    /// `rtol`: `f64`
+    /// - relative tolerance of the error estimate.
+    ///
+    /// `atol`: `f64`
+    /// - absolute tolerance of the error estimate.
+    ///
+    /// # Returns
+    /// `BatchResult` : the t, x, y, kx, and ky arrays, each with shape
+    /// (ray, time_step). Rays with fewer steps than the longest one are
+    /// padded with NaN.
+    ///
+    /// # Panics
+    /// If the initial conditions do not have the same length, or if
+    /// `step_size` is not positive and finite.
+    pub(crate) fn trace_adaptive(
+        &self,
+        x0: &[f64],
+        y0: &[f64],
+        kx0: &[f64],
+        ky0: &[f64],
+        start_time: f64,
+        end_time: f64,
+        step_size: f64,
+        rtol: f64,
+        atol: f64,
+    ) -> BatchResult {
+        let n_rays = x0.len();
+        assert!(
+            y0.len() == n_rays && kx0.len() == n_rays && ky0.len() == n_rays,
+            "initial conditions must have the same length"
+        );
+        check_step_size(step_size);
+
+        let f = |s: &[f64; 4]| match self.system.odes(&s[0], &s[1], &s[2], &s[3]) {
+            Ok((dxdt, dydt, dkxdt, dkydt)) => [dxdt, dydt, dkxdt, dkydt],
+            Err(_) => [f64::NAN; 4],
+        };
+        let paths: Vec<Vec<[f64; 5]>> = (0..n_rays)
+            .into_par_iter()
+            .map(|i| {
+                adaptive_path(
+                    &f,
+                    [x0[i], y0[i], kx0[i], ky0[i]],
+                    start_time,
+                    end_time,
+                    step_size,
+                    rtol,
+                    atol,
+                )
+            })
+            .collect();
+
+        let n_records = paths.iter().map(|p| p.len()).max().unwrap_or(0);
+        let [mut t, mut x, mut y, mut kx, mut ky] =
+            [(); 5].map(|_| Array2::from_elem((n_rays, n_records), f64::NAN));
+        for (i, path) in paths.iter().enumerate() {
+            for (j, v) in path.iter().enumerate() {
+                t[[i, j]] = v[0];
+                x[[i, j]] = v[1];
+                y[[i, j]] = v[2];
+                kx[[i, j]] = v[3];
+                ky[[i, j]] = v[4];
+            }
+        }
+        BatchResult { t, x, y, kx, ky }
+    }
+}
+
+/// Stack the results of consecutive chunks of rays
+///
+/// The chunks may have a different number of time steps, so the shorter
+/// ones are padded with NaN up to the longest one.
+fn stack(chunks: &[BatchResult], n_rays: usize) -> BatchResult {
+    let n_records = chunks.iter().map(|c| c.t.ncols()).max().unwrap_or(0);
+    let [mut t, mut x, mut y, mut kx, mut ky] =
+        [(); 5].map(|_| Array2::from_elem((n_rays, n_records), f64::NAN));
+
+    let mut start = 0;
+    for c in chunks {
+        let (n, m) = c.t.dim();
+        t.slice_mut(s![start..start + n, ..m]).assign(&c.t);
+        x.slice_mut(s![start..start + n, ..m]).assign(&c.x);
+        y.slice_mut(s![start..start + n, ..m]).assign(&c.y);
+        kx.slice_mut(s![start..start + n, ..m]).assign(&c.kx);
+        ky.slice_mut(s![start..start + n, ..m]).assign(&c.ky);
+        start += n;
+    }
+    BatchResult { t, x, y, kx, ky }
+}
+
+/// One step of the embedded Runge-Kutta-Cash-Karp 5(4) method
+///
+/// See Press et al., Numerical Recipes, section 16.2.
+///
+/// # Arguments
+/// `f` : `&impl Fn(&[f64; 4]) -> [f64; 4]`
+/// - the derivatives of the (autonomous) system at a given state
+///
+/// `s` : `&[f64; 4]`
+/// - the state at the beginning of the step
+///
+/// `h` : `f64`
+/// - the step size
+///
+/// # Returns
+/// `([f64; 4], [f64; 4])` : the fifth order solution at the end of the step
+/// and the estimate of its error, i.e. the difference from the embedded
+/// fourth order solution.
+fn cash_karp_step(
+    f: &impl Fn(&[f64; 4]) -> [f64; 4],
+    s: &[f64; 4],
+    h: f64,
+) -> ([f64; 4], [f64; 4]) {
+    const A2: [f64; 1] = [1.0 / 5.0];
+    const A3: [f64; 2] = [3.0 / 40.0, 9.0 / 40.0];
+    const A4: [f64; 3] = [3.0 / 10.0, -9.0 / 10.0, 6.0 / 5.0];
+    const A5: [f64; 4] = [-11.0 / 54.0, 5.0 / 2.0, -70.0 / 27.0, 35.0 / 27.0];
+    const A6: [f64; 5] = [
+        1631.0 / 55296.0,
+        175.0 / 512.0,
+        575.0 / 13824.0,
+        44275.0 / 110592.0,
+        253.0 / 4096.0,
+    ];
+    // fifth order weights
+    const B: [f64; 6] = [
+        37.0 / 378.0,
+        0.0,
+        250.0 / 621.0,
+        125.0 / 594.0,
+        0.0,
+        512.0 / 1771.0,
+    ];
+    // difference between the fifth and the fourth order weights
+    const E: [f64; 6] = [
+        37.0 / 378.0 - 2825.0 / 27648.0,
+        0.0,
+        250.0 / 621.0 - 18575.0 / 48384.0,
+        125.0 / 594.0 - 13525.0 / 55296.0,
+        -277.0 / 14336.0,
+        512.0 / 1771.0 - 0.25,
+    ];
+
+    // s + h * sum(a[j] * k[j])
+    let stage = |a: &[f64], k: &[[f64; 4]]| -> [f64; 4] {
+        let mut out = *s;
+        for (aj, kj) in a.iter().zip(k) {
+            for i in 0..4 {
+                out[i] += h * aj * kj[i];
+            }
+        }
+        out
+    };
+
+    let mut k = [[0.0; 4]; 6];
+    k[0] = f(s);
+    k[1] = f(&stage(&A2, &k[..1]));
+    k[2] = f(&stage(&A3, &k[..2]));
+    k[3] = f(&stage(&A4, &k[..3]));
+    k[4] = f(&stage(&A5, &k[..4]));
+    k[5] = f(&stage(&A6, &k[..5]));
+
+    let s_new = stage(&B, &k);
+    let mut err = [0.0; 4];
+    for (ej, kj) in E.iter().zip(&k) {
+        for i in 0..4 {
+            err[i] += h * ej * kj[i];
+        }
+    }
+    (s_new, err)
+}
+
+/// Integrate one ray with an adaptive time step
+///
+/// Each step is accepted if the error estimate of `cash_karp_step`, scaled by
+/// `atol + rtol * |s|` for each component, is at most one. The next step is
+/// then adjusted toward the step that would give an error of one.
+///
+/// # Arguments
+/// `f` : `&impl Fn(&[f64; 4]) -> [f64; 4]`
+/// - the derivatives of the (autonomous) system at a given state
+///
+/// `s0` : `[f64; 4]`
+/// - the initial state
+///
+/// `start_time`, `end_time` : `f64`
+/// - integration interval
+///
+/// `step_size` : `f64`
+/// - the initial time step
+///
+/// `rtol`, `atol` : `f64`
+/// - relative and absolute tolerances
+///
+/// # Returns
+/// `Vec<[f64; 5]>` : the (t, x, y, kx, ky) of every accepted step, including
+/// the initial state. A step that results in a NaN state, such as when
+/// leaving the domain, is rejected and retried shorter. The integration stops
+/// once such a step is already at the minimum step size.
+fn adaptive_path(
+    f: &impl Fn(&[f64; 4]) -> [f64; 4],
+    s0: [f64; 4],
+    start_time: f64,
+    end_time: f64,
+    step_size: f64,
+    rtol: f64,
+    atol: f64,
+) -> Vec<[f64; 5]> {
+    if s0.iter().any(|v| v.is_nan()) {
+        return vec![];
+    }
+    // reserve for as many steps as the initial step size would take, up to
+    // INITIAL_RECORDS, the path grows as needed after that
+    let mut path =
+        Vec::with_capacity((num_steps(start_time, end_time, step_size) + 1).min(INITIAL_RECORDS));
+
+    let min_step = MIN_STEP_FRACTION * step_size;
+    let mut t = start_time;
+    let mut s = s0;
+    let mut h = step_size;
+    path.push([t, s[0], s[1], s[2], s[3]]);
+
+    while t < end_time {
+        // don't overshoot, and land exactly on, the end time
+        let last_step = h >= end_time - t;
+        let h_try = if last_step { end_time - t } else { h };
+        let (s_new, err) = cash_karp_step(f, &s, h_try);
+        if s_new.iter().any(|v| v.is_nan()) {
+            // the trial step left the domain, retry shorter to get closer to
+            // the boundary, until the step can't be any shorter
+            if h_try <= min_step {
+                break;
+            }
+            h = (h_try * MIN_FACTOR).max(min_step);
+            continue;
+        }
+
+        let err_norm = (0..4)
+            .map(|i| err[i].abs() / (atol + rtol * s[i].abs().max(s_new[i].abs())))
+            .fold(0.0, f64::max);
+
+        if err_norm <= 1.0 || h_try <= min_step {
+            t = if last_step { end_time } else { t + h_try };
+            s = s_new;
+            path.push([t, s[0], s[1], s[2], s[3]]);
+            h = if err_norm == 0.0 {
+                h_try * MAX_FACTOR
+            } else {
+                h_try * (SAFETY * err_norm.powf(-0.2)).min(MAX_FACTOR)
+            };
+        } else {
+            h = h_try * (SAFETY * err_norm.powf(-0.25)).max(MIN_FACTOR);
+        }
+        h = h.max(min_step);
+    }
+    path
+}
+
+/// Append (t, x, y, kx, ky) of each ray as the next record of `history`,
+/// or NaN for the rays that are no longer active.
+fn record(history: &mut [Vec<f64>; 5], t: f64, state: &BatchState, active: &[bool]) {
+    for (i, a) in active.iter().enumerate() {
+        let values = if *a {
+            [t, state.x[i], state.y[i], state.kx[i], state.ky[i]]
+        } else {
+            [f64::NAN; 5]
+        };
+        for (h, v) in history.iter_mut().zip(values) {
+            h.push(v);
+        }
+    }
+}
+
+#[cfg(test)]
+mod test_ray_batch {
+
+    use tempfile::NamedTempFile;
+
+    use super::{adaptive_path, cash_karp_step, RayBatch, DEFAULT_ATOL, DEFAULT_RTOL};
+    use crate::bathymetry::{BathymetryData, CartesianNetcdf3, ConstantDepth, ConstantSlope};
+    use crate::current::ConstantCurrent;
+    use crate::datatype::{Point, RayState, WaveNumber};
+    use crate::io::utility::create_netcdf3_bathymetry;
+    use crate::ray::SingleRay;
+
+    #[test]
+    /// more rays than fit in a chunk are stacked back in the same order
+    fn many_chunks() {
+        let bathymetry_data = ConstantDepth::new(2000.0);
+        let current_data = ConstantCurrent::new(0.0, 0.0);
+        let batch = RayBatch::new(&bathymetry_data, &current_data);
+
+        let n = 3 * super::CHUNK + 1;
+        let y0: Vec<f64> = (0..n).map(|i| i as f64).collect();
+        let out = batch.trace(
+            &vec![0.0; n],
+            &y0,
+            &vec![0.05; n],
+            &vec![0.0; n],
+            0.0,
+            10.0,
+            2.0,
+        );
+
+        assert_eq!(out.y.shape(), &[n, 6]);
+        for i in 0..n {
+            assert_eq!(out.y[[i, 5]], y0[i]);
+        }
+    }
+
+    #[test]
+    /// rays over constant depth keep their wavenumber and have one record per
+    /// time step, including the initial condition.
+    fn constant_depth() {
+        let bathymetry_data = ConstantDepth::new(2000.0);
+        let current_data = ConstantCurrent::new(0.0, 0.0);
+        let batch = RayBatch::new(&bathymetry_data, &current_data);
+
+        let out = batch.trace(
+            &[0.0, 0.0, 0.0],
+            &[0.0, 10.0, 20.0],
+            &[0.05, 0.0, 0.03],
+            &[0.0, 0.05, 0.04],
+            0.0,
+            10.0,
+            2.0,
+        );
+
+        assert_eq!(out.t.shape(), &[3, 6]);
+        assert_eq!(out.ky.shape(), &[3, 6]);
+        for i in 0..3 {
+            for j in 0..6 {
+                assert_eq!(out.t[[i, j]], 2.0 * j as f64);
+                assert_eq!(out.kx[[i, j]], out.kx[[i, 0]]);
+                assert_eq!(out.ky[[i, j]], out.ky[[i, 0]]);
+            }
+        }
+    }
+
+    #[test]
+    /// Cash-Karp is exact, up to rounding, for a system with constant
+    /// derivatives and for a linear system its error estimate is small.
+    fn cash_karp_linear() {
+        let f = |_s: &[f64; 4]| [1.0, -2.0, 0.0, 0.5];
+        let (s, err) = cash_karp_step(&f, &[0.0, 1.0, 2.0, 3.0], 2.0);
+        for (v, expected) in s.iter().zip([2.0, -3.0, 2.0, 4.0]) {
+            assert!((v - expected).abs() < 1e-12);
+        }
+        assert!(err.iter().all(|e| e.abs() < 1e-12));
+
+        // exponential decay, ds/dt = -s
+        let f = |s: &[f64; 4]| [-s[0], -s[1], -s[2], -s[3]];
+        let (s, err) = cash_karp_step(&f, &[1.0; 4], 0.1);
+        assert!((s[0] - (-0.1_f64).exp()).abs() < 1e-8);
+        assert!(err[0].abs() < 1e-6);
+    }
+
+    #[test]
+    /// the adaptive path reaches the end time within the tolerance and takes
+    /// longer steps when the solution is smooth
+    fn adaptive_exponential_decay() {
+        let f = |s: &[f64; 4]| [-s[0], 0.0, 0.0, 0.0];
+        let path = adaptive_path(&f, [1.0, 0.0, 0.0, 0.0], 0.0, 10.0, 0.01, 1e-8, 1e-12);
+
+        let last = path.last().unwrap();
+        assert_eq!(last[0], 10.0);
+        assert!((last[1] - (-10.0_f64).exp()).abs() < 1e-8);
+        assert!(path.len() < 1000);
+        assert!(path[2][0] - path[1][0] > path[1][0] - path[0][0]);
+    }
+
+    #[test]
+    /// a step leaving the domain is retried shorter, so the adaptive path
+    /// stops at the boundary instead of at the last accepted long step
+    fn adaptive_path_boundary() {
+        // constant speed, only defined for x <= 10
+        let f = |s: &[f64; 4]| {
+            if s[0] <= 10.0 {
+                [1.0, 0.0, 0.0, 0.0]
+            } else {
+                [f64::NAN; 4]
+            }
+        };
+        let path = adaptive_path(&f, [0.0; 4], 0.0, 100.0, 0.01, 1e-8, 1e-12);
+
+        let last = path.last().unwrap();
+        assert!(last[1] <= 10.0);
+        assert!(last[1] > 10.0 - 1e-6);
+        assert!((last[0] - last[1]).abs() < 1e-9);
+    }
+
+    #[test]
+    /// the adaptive batch keeps the wavenumber over constant depth and pads
+    /// with NaN a ray with a NaN initial condition
+    fn adaptive_constant_depth() {
+        let bathymetry_data = ConstantDepth::new(2000.0);
+        let current_data = ConstantCurrent::new(0.0, 0.0);
+        let batch = RayBatch::new(&bathymetry_data, &current_data);
+
+        let out = batch.trace_adaptive(
+            &[0.0, f64::NAN],
+            &[0.0, 0.0],
+            &[0.05, 0.05],
+            &[0.0, 0.0],
+            0.0,
+            1000.0,
+            1.0,
+            DEFAULT_RTOL,
+            DEFAULT_ATOL,
+        );
+
+        let n = out.t.ncols();
+        assert!(n > 1 && n < 1000);
+        assert_eq!(out.t[[0, n - 1]], 1000.0);
+        assert!(out.kx.row(0).iter().all(|kx| *kx == 0.05));
+        assert!(out.x.row(1).iter().all(|x| x.is_nan()));
+    }
+
+    #[test]
+    /// a ray leaving the grid in adaptive mode gets as close to the edge as
+    /// with the fixed step, even after its time step has grown long
+    fn adaptive_leaving_grid() {
+        fn depth_fn(_x: f32, _y: f32) -> f64 {
+            2000.0
+        }
+        let tmp_path = NamedTempFile::new().unwrap().into_temp_path();
+        create_netcdf3_bathymetry(&tmp_path, 100, 100, 1.0, 1.0, depth_fn);
+        let bathymetry_data = CartesianNetcdf3::open(&tmp_path, "x", "y", "depth").unwrap();
+        let current_data = ConstantCurrent::new(0.0, 0.0);
+        let batch = RayBatch::new(&bathymetry_data, &current_data);
+
+        let last_x =
+            |x: ndarray::ArrayView1<f64>| x.iter().filter(|x| !x.is_nan()).last().copied().unwrap();
+        let fixed = batch.trace(&[10.0], &[50.0], &[0.05], &[0.0], 0.0, 100.0, 1.0);
+        let adaptive = batch.trace_adaptive(
+            &[10.0],
+            &[50.0],
+            &[0.05],
+            &[0.0],
+            0.0,
+            100.0,
+            0.01,
+            DEFAULT_RTOL,
+            DEFAULT_ATOL,
+        );
+
+        let fixed_x = last_x(fixed.x.row(0));
+        let adaptive_x = last_x(adaptive.x.row(0));
+        assert!(fixed_x > 90.0 && fixed_x <= 99.0);
+        assert!(adaptive_x >= fixed_x);
+        assert!(adaptive_x > 99.0 - 1e-3);
+    }
+
+    #[test]
+    /// the output only grows as long as the rays last, not as long as the
+    /// requested duration
+    fn long_duration() {
+        fn depth_fn(_x: f32, _y: f32) -> f64 {
+            2000.0
+        }
+        let tmp_path = NamedTempFile::new().unwrap().into_temp_path();
+        create_netcdf3_bathymetry(&tmp_path, 100, 100, 1.0, 1.0, depth_fn);
+        let bathymetry_data = CartesianNetcdf3::open(&tmp_path, "x", "y", "depth").unwrap();
+        let current_data = ConstantCurrent::new(0.0, 0.0);
+        let batch = RayBatch::new(&bathymetry_data, &current_data);
+
+        let out = batch.trace(
+            &[10.0; 3], &[50.0; 3], &[0.05; 3], &[0.0; 3], 0.0, 1e12, 1.0,
+        );
+        assert!(out.t.ncols() < 20);
+
+        let out = batch.trace_adaptive(
+            &[10.0],
+            &[50.0],
+            &[0.05],
+            &[0.0],
+            0.0,
+            1e12,
+            1.0,
+            DEFAULT_RTOL,
+            DEFAULT_ATOL,
+        );
+        assert!(out.x.iter().all(|x| x.is_nan() || *x <= 99.0));
+    }
+
+    #[test]
+    #[should_panic(expected = "step_size must be positive and finite")]
+    fn zero_step_size() {
+        let bathymetry_data = ConstantDepth::new(2000.0);
+        let current_data = ConstantCurrent::new(0.0, 0.0);
+        let batch = RayBatch::new(&bathymetry_data, &current_data);
+        batch.trace(&[0.0], &[0.0], &[0.05], &[0.0], 0.0, 10.0, 0.0);
+    }
+
+    #[test]
+    /// the batch integration matches the individual integration of each ray
+    /// with `ode_solvers`
+    fn same_as_single_ray() {
+        let bathymetry_data: &dyn BathymetryData = &ConstantSlope::builder().build().unwrap();
+        let current_data = ConstantCurrent::new(0.0, 0.0);
+        let batch = RayBatch::new(bathymetry_data, &current_data);
+
+        let y0 = [10.0, 50.0, 90.0];
+        let out = batch.trace(&[10.0; 3], &y0, &[1.0; 3], &[0.0; 3], 0.0, 100.0, 1.0);
+
+        for (i, y) in y0.iter().enumerate() {
+            let initial_ray = RayState::new(Point::new(10.0, *y), WaveNumber::new(1.0, 0.0));
+            let wave = SingleRay::new(bathymetry_data, &current_data, &initial_ray);
+            let res = wave.trace_individual(0.0, 100.0, 1.0).unwrap();
+            let (t, s) = res.get();
+            for (j, (t, s)) in t.iter().zip(s.iter()).enumerate() {
+                if s[0].is_nan() {
+                    break;
+                }
+                assert_eq!(out.t[[i, j]], *t);
+                for (k, v) in [&out.x, &out.y, &out.kx, &out.ky].iter().enumerate() {
+                    assert!((v[[i, j]] - s[k]).abs() <= 1e-9 * s[k].abs().max(1.0));
+                }
+            }
+        }
+    }
+}